@@ -31,6 +31,19 @@ __repo__ = "https://github.com/adafruit/Adafruit_CircuitPython_DotStar.git"
 
 START_HEADER_SIZE = 4
 
+# Data line levels for every bit of a byte value, most significant bit first. Filled
+# in lazily, as soft SPI meets each byte value, to keep RAM use down.
+_BIT_LEVELS = [None] * 256
+
+
+def _bit_levels(value: int) -> tuple:
+    levels = _BIT_LEVELS[value]
+    if levels is None:
+        levels = tuple(bool(value << i & 0x80) for i in range(8))
+        _BIT_LEVELS[value] = levels
+    return levels
+
+
 # Pixel color order constants
 RBG = "PRBG"
 """Red Blue Green"""
@@ -63,6 +76,9 @@ class DotStar(adafruit_pixelbuf.PixelBuf):
         using 'soft' SPI). This is only a recommendation; the actual clock
         rate may be slightly different depending on what the system hardware
         can provide.
+    :param bool partial_updates: Only transmit up to the last pixel that changed
+        since the previous show, and skip the transmission entirely if nothing
+        changed. Pixels further down the chain keep the color they latched.
 
     Example for Gemma M0:
 
@@ -104,7 +120,8 @@ class DotStar(adafruit_pixelbuf.PixelBuf):
         brightness: float = 1.0,
         auto_write: bool = True,
         pixel_order: str = BGR,
-        baudrate: int = 4000000
+        baudrate: int = 4000000,
+        partial_updates: bool = False
     ) -> None:
         self._spi = None
         try:
@@ -130,6 +147,15 @@ class DotStar(adafruit_pixelbuf.PixelBuf):
         # 0xff bytes for the trailer.
         trailer = bytearray(b"\xff") * trailer_size
 
+        # Copy of the last transmitted buffer for partial updates. Their end frame
+        # is zeros, which a pixel past the changed ones ignores like a start frame.
+        self._partial_updates = partial_updates
+        self._last_sent = None
+        self._partial_buffer = None
+        self._zero_trailer = bytes(trailer_size)
+        # Bytes sent by the last show, 0 if a partial update found nothing changed.
+        self.last_transmit_bytes = 0
+
         super().__init__(
             n,
             byteorder=pixel_order,
@@ -171,16 +197,61 @@ class DotStar(adafruit_pixelbuf.PixelBuf):
         return len(self)
 
     def _transmit(self, buffer: ReadableBuffer) -> None:
+        if self._partial_updates:
+            self._transmit_changed(buffer)
+            return
+        self.last_transmit_bytes = len(buffer)
         if self._spi:
             self._spi.write(buffer)
         else:
             self._ds_writebytes(buffer)
 
+    def _transmit_changed(self, buffer: ReadableBuffer) -> None:
+        last = self._last_sent
+        if last is None:
+            # nothing latched yet, send everything
+            self._last_sent = bytearray(buffer)
+            self._partial_buffer = bytearray(len(buffer))
+            self.last_transmit_bytes = len(buffer)
+            if self._spi:
+                self._spi.write(buffer)
+            else:
+                self._ds_writebytes(buffer)
+            return
+
+        # find the last pixel that changed
+        changed = len(self)
+        end = START_HEADER_SIZE + 4 * changed
+        while changed and buffer[end - 4 : end] == last[end - 4 : end]:
+            changed -= 1
+            end -= 4
+        if not changed:
+            self.last_transmit_bytes = 0
+            return
+
+        # send the changed prefix followed by a zero end frame in one transfer
+        last[START_HEADER_SIZE:end] = buffer[START_HEADER_SIZE:end]
+        trailer_size = (changed + 15) // 16
+        send = self._partial_buffer
+        send[:end] = buffer[:end]
+        send[end : end + trailer_size] = self._zero_trailer[:trailer_size]
+        self.last_transmit_bytes = end + trailer_size
+        if self._spi:
+            self._spi.write(send, end=end + trailer_size)
+        else:
+            self._ds_writebytes(memoryview(send)[: end + trailer_size])
+
     def _ds_writebytes(self, buffer: ReadableBuffer) -> None:
+        # Look up each byte's bit levels, and only drive the data line when the
+        # level changes; the clock is toggled once per bit.
+        dpin = self.dpin
+        cpin = self.cpin
+        level = None
         for b in buffer:
-            for _ in range(8):
-                self.dpin.value = b & 0x80
-                self.cpin.value = True
-                self.cpin.value = False
-                b = b << 1
-        self.cpin.value = False
+            for bit in _BIT_LEVELS[b] or _bit_levels(b):
+                if bit is not level:
+                    dpin.value = bit
+                    level = bit
+                cpin.value = True
+                cpin.value = False
+        cpin.value = False
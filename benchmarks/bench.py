@@ -0,0 +1,667 @@
+# bench.py
+
+__author__ = "thekraftyman"
+
+'''
+Benchmark suite for the pico keypad libraries, run on a computer through pad_sim.
+
+Every scenario runs on a fresh simulator with virtual time, so bus, led and usb
+timings come out the same on every run. Host cpu time is reported next to them as
+`host_*` metrics; it only compares versions run on the same machine.
+
+    python benchmarks/bench.py                          # run everything, save bench_results.json
+    python benchmarks/bench.py -o new.json -c old.json  # save, then compare against old results
+    python benchmarks/bench.py scan_latency             # run some scenarios
+'''
+
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import time as _time
+import tracemalloc
+
+ROOT = os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) )
+sys.path.insert( 0, ROOT )
+
+import pad_sim
+pad_sim.install()
+
+import time
+import adafruit_dotstar
+import board
+import ducky_engine
+from ducky_engine import DuckyEngine
+import pad_lib
+from pad_lib import Key, MacroPad
+
+# --------------
+# CONTENTS
+# 1. Helpers
+# 2. Scenarios
+# 3. Runner
+# --------------
+
+SCENARIOS = []
+
+# metrics where bigger is better, everything else is better smaller
+HIGHER_IS_BETTER = ( "_per_s", )
+
+# 1. Helpers ---
+
+def scenario( func ):
+    '''
+    register a benchmark scenario, a function returning a dict of metrics
+    '''
+    SCENARIOS.append( func )
+    return func
+
+
+def fresh( **kwargs ):
+    '''
+    install a new simulator, so every scenario starts from time 0 with empty logs
+    '''
+    return pad_sim.install( **kwargs )
+
+
+def stats( prefix, values ):
+    '''
+    summary metrics of a list of nanosecond values, in microseconds
+    '''
+    if not values:
+        return { f"{prefix}_count": 0 }
+    values = sorted( values )
+    return {
+        f"{prefix}_count": len( values ),
+        f"{prefix}_mean_us": round( sum( values ) / len( values ) / 1000, 1 ),
+        f"{prefix}_p50_us": round( values[ len( values ) // 2 ] / 1000, 1 ),
+        f"{prefix}_p95_us": round( values[ min( len( values ) - 1, len( values ) * 95 // 100 ) ] / 1000, 1 ),
+        f"{prefix}_max_us": round( values[-1] / 1000, 1 ),
+    }
+
+
+def host_ns():
+    return _time.perf_counter_ns()
+
+
+class NullLog( list ):
+    '''
+    simulator log that keeps nothing, so heap measurements only see the code under test
+    '''
+    def append( self, record ):
+        pass
+
+
+# 2. Scenarios ---
+
+@scenario
+def scan_latency():
+    '''
+    press-to-callback latency of the event loop polling every 2 ms, with taps of
+      different lengths and contact bounce
+    '''
+    sim = fresh()
+    pad = MacroPad()
+    taps = {}
+    latencies = []
+
+    def callback( key ):
+        now = time.monotonic_ns()
+        latencies.append( now - max( at for at in taps[ key ] if at <= now ) )
+
+    for key in range( 16 ):
+        pad.bind_key( key, callback, kwargs={ "key" : key } )
+        taps[ key ] = []
+
+    # one tap every 37 ms, lengths from 4 to 60 ms, bounce on every other one
+    at = 10
+    for i in range( 64 ):
+        key = i % 16
+        duration = 4 + i * 7 % 57
+        if i % 2:
+            sim.keypad.script( [ (at, key, True), (at + 0.5, key, False), (at + 1, key, True) ] )
+        else:
+            sim.keypad.press( key, at=at )
+        sim.keypad.release( key, at=at + duration )
+        taps[ key ].append( time.monotonic_ns() + at * 1000000 )
+        at += 37
+
+    end = time.monotonic_ns() + ( at + 100 ) * 1000000
+    loops = 0
+    began = host_ns()
+    while time.monotonic_ns() < end:
+        pad.dispatch()
+        loops += 1
+        time.sleep( 0.002 )
+    host = host_ns() - began
+
+    metrics = stats( "latency", latencies )
+    metrics[ "missed_taps" ] = 64 - len( latencies )
+    metrics[ "i2c_per_loop" ] = round( len( sim.i2c_log ) / loops, 2 )
+    metrics[ "host_per_loop_us" ] = round( host / loops / 1000, 1 )
+    return metrics
+
+
+@scenario
+def legacy_queries():
+    '''
+    i2c transactions and time per loop for the polling style of the original examples:
+      is_pressed, bound_pressed_buttons and a Key.is_pressed in every iteration
+    '''
+    sim = fresh()
+    pad = MacroPad()
+    pad.bind_key( 0, print )
+    sim.keypad.press( 0, at=0 )
+    loops = 200
+    began = host_ns()
+    virtual = time.monotonic_ns()
+    for i in range( loops ):
+        pad.is_pressed
+        pad.bound_pressed_buttons
+        pad.keys[0].is_pressed
+        time.sleep( 0.01 )
+    return {
+        "i2c_per_loop": round( len( sim.i2c_log ) / loops, 2 ),
+        "bus_per_loop_us": round( ( time.monotonic_ns() - virtual ) / loops / 1000 - 10000, 1 ),
+        "host_per_loop_us": round( ( host_ns() - began ) / loops / 1000, 1 ),
+    }
+
+
+@scenario
+def idle_bus():
+    '''
+    i2c transactions in one idle second of a pad running dispatch every 1ms, polling
+      against gated by the expander's interrupt line, and press to callback latency
+    '''
+    metrics = {}
+    for mode in ( "poll", "interrupt" ):
+        sim = fresh()
+        if mode == "interrupt":
+            sim.keypad.wire_interrupt( board.GP3 )
+            pad = MacroPad( interrupt=board.GP3 )
+        else:
+            pad = MacroPad()
+        pressed = []
+        pad.bind_key( 0, lambda: pressed.append( time.monotonic_ns() ) )
+        sim.reset_logs()
+        for i in range( 1000 ):
+            pad.dispatch()
+            time.sleep( 0.001 )
+        metrics[ f"{mode}_idle_i2c" ] = len( sim.i2c_log )
+
+        sim.keypad.tap( 0, at=0.5, duration=40 )
+        start = time.monotonic_ns() + 500000
+        while not pressed:
+            pad.dispatch()
+            time.sleep( 0.001 )
+        metrics[ f"{mode}_latency_us" ] = round( ( pressed[0] - start ) / 1000, 1 )
+    return metrics
+
+
+@scenario
+def expander_scan():
+    '''
+    bus time and host time of a scan with 1, 2 and 4 expanders chained on the bus, 16
+      keys each
+    '''
+    metrics = {}
+    for count in ( 1, 2, 4 ):
+        sim = fresh()
+        addresses = [ 0x20 + n for n in range( count ) ]
+        for address in addresses[1:]:
+            sim.add_expander( address )
+        pad = MacroPad( expanders=addresses )
+        sim.reset_logs()
+        start = time.monotonic_ns()
+        began = host_ns()
+        for i in range( 100 ):
+            pad.update()
+        metrics[ f"x{count}_scan_bus_us" ] = round( ( time.monotonic_ns() - start ) / 100000, 1 )
+        metrics[ f"x{count}_i2c_per_scan" ] = len( sim.i2c_log ) / 100
+        metrics[ f"host_x{count}_update_us" ] = round( ( host_ns() - began ) / 100000, 1 )
+    return metrics
+
+
+@scenario
+def adaptive_scan():
+    '''
+    a main loop paced by wait_for_scan: i2c transactions in an idle second, scan rate
+      while typing, and press to callback latency from idle and while typing
+    '''
+    metrics = {}
+    sim = fresh()
+    pad = MacroPad()
+    pressed = []
+    pad.bind_key( 0, lambda: pressed.append( time.monotonic_ns() ) )
+    pad.bind_key( 1, lambda: pressed.append( time.monotonic_ns() ) )
+
+    def loop( ms ):
+        end = time.monotonic_ns() + ms * 1000000
+        while time.monotonic_ns() < end:
+            pad.dispatch()
+            pad.wait_for_scan()
+
+    # settle into idle, then measure an idle second
+    loop( 3000 )
+    sim.reset_logs()
+    loop( 1000 )
+    metrics[ "idle_i2c" ] = len( sim.i2c_log )
+
+    # a press from idle, then a second press while the first key is held
+    latencies = []
+    for key, at in ( ( 0, 7.3 ), ( 1, 53.9 ) ):
+        start = time.monotonic_ns() + int( at * 1000000 )
+        sim.keypad.tap( key, at=at, duration=200 )
+        del pressed[:]
+        while not pressed:
+            pad.dispatch()
+            pad.wait_for_scan()
+        latencies.append( round( ( pressed[0] - start ) / 1000, 1 ) )
+    metrics[ "idle_latency_us" ], metrics[ "active_latency_us" ] = latencies
+
+    sim.keypad.press( 2 )
+    loop( 2000 )
+    metrics[ "active_scans_per_s" ] = round( pad.scan_rate )
+    return metrics
+
+
+MACRO = """
+DELAY 10
+GUI R
+DELAY 10
+STRING notepad
+ENTER
+DELAY 10
+STRING The quick brown fox jumps over the lazy dog. THE QUICK BROWN FOX JUMPS OVER THE LAZY DOG!
+ENTER
+STRING 0123456789 ~!@#$%^&*()_+ {}|:"<>? [];',./ aabbccdd
+CTRL A
+CTRL C
+"""
+
+@scenario
+def macro_throughput():
+    '''
+    hid reports and characters per second for run_multiline_string on a typical macro
+    '''
+    fresh()
+    engine = DuckyEngine()
+    sim = fresh()
+    compile_began = host_ns()
+    engine.compile( MACRO )
+    compile_host = host_ns() - compile_began
+
+    runs = 5
+    began = host_ns()
+    start = time.monotonic_ns()
+    for i in range( runs ):
+        engine.run_multiline_string( MACRO )
+    elapsed = time.monotonic_ns() - start
+    host = host_ns() - began
+
+    chars = sum( len( line.strip()[7:] ) for line in MACRO.split( "\n" ) if line.strip().startswith( "STRING" ) )
+    reports = len( sim.keyboard_reports )
+    return {
+        "reports_per_run": reports // runs,
+        "reports_per_s": round( reports * 1000000000 / elapsed ),
+        "chars_per_s": round( chars * runs * 1000000000 / elapsed ),
+        "run_ms": round( elapsed / runs / 1000000, 2 ),
+        "host_compile_us": round( compile_host / 1000, 1 ),
+        "host_run_us": round( host / runs / 1000, 1 ),
+    }
+
+
+@scenario
+def loop_script():
+    '''
+    compiled size and host time of a block typed 100 times, written out line by line
+      against a FOR loop
+    '''
+    metrics = {}
+    body = "STRING line\nENTER\n"
+    for name, script in (
+        ( "unrolled", body * 100 ),
+        ( "loop", "FOR 100\n" + body + "END_FOR\n" ),
+    ):
+        sim = fresh()
+        sim.hid_log = NullLog()
+        engine = DuckyEngine()
+        began = host_ns()
+        compiled = engine.compile( script )
+        metrics[ f"host_{name}_compile_us" ] = round( ( host_ns() - began ) / 1000, 1 )
+        began = host_ns()
+        engine.run_compiled( compiled )
+        metrics[ f"host_{name}_run_us" ] = round( ( host_ns() - began ) / 1000, 1 )
+        metrics[ f"{name}_source_bytes" ] = len( script )
+        metrics[ f"{name}_compiled_bytes" ] = compiled.nbytes
+    return metrics
+
+
+@scenario
+def delay_drift():
+    '''
+    how far a script of typing and delays runs over the sum of its delays, and its
+      late delays, with the host taking 1ms per report
+    '''
+    fresh()
+    engine = DuckyEngine()
+    script = engine.compile( "STRING abcdefgh\nDELAY 20\n" * 50 + "DEFAULT_DELAY 1\n" + "ENTER\n" * 50 )
+    start = time.monotonic_ns()
+    engine.run_compiled( script )
+    elapsed = time.monotonic_ns() - start
+    waits, late, total, most = engine.drift_stats
+
+    # 50 delays of 20ms, and 10ms after DEFAULT_DELAY and each of the 50 ENTERs
+    planned = 50 * 20000000 + 51 * 10000000
+    return {
+        "overrun_ms": round( ( elapsed - planned ) / 1000000, 2 ),
+        "late_delays": late,
+        "max_late_ms": round( most / 1000000, 2 ),
+    }
+
+
+@scenario
+def file_stream():
+    '''
+    peak heap and host time to run a large script file: compiled whole, streamed from
+      the text while writing the precompiled file, and streamed from the precompiled file
+    '''
+    metrics = {}
+    fresh()
+    engine = DuckyEngine()
+    path = os.path.join( tempfile.mkdtemp(), "payload.txt" )
+    with open( path, "w" ) as outfile:
+        for i in range( 50 ):
+            outfile.write( MACRO )
+
+    for name, run in (
+        ( "compiled", lambda: engine.run_ops( engine.compile_lines( open( path ) ) ) ),
+        ( "text", lambda: engine.run_file( path ) ),
+        ( "precompiled", lambda: engine.run_file( path ) ),
+    ):
+        sim = fresh()
+        sim.hid_log = NullLog()
+        engine.default_delay = 0
+        tracemalloc.start()
+        began = host_ns()
+        run()
+        metrics[ f"host_{name}_us" ] = round( ( host_ns() - began ) / 1000, 1 )
+        metrics[ f"{name}_peak_bytes" ] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    metrics[ "precompiled_bytes" ] = os.stat( path + ducky_engine.CACHE_SUFFIX ).st_size
+    metrics[ "source_bytes" ] = os.stat( path ).st_size
+    return metrics
+
+
+@scenario
+def led_frame():
+    '''
+    spi transfers, bytes and time for led updates: a single key, a full repaint key by
+      key and a bulk repaint, with and without the framebuffer
+    '''
+    metrics = {}
+    for framebuffer in ( False, True ):
+        sim = fresh()
+        began = host_ns()
+        pad = MacroPad( framebuffer=framebuffer )
+        host_init = host_ns() - began
+        mode = "fb" if framebuffer else "direct"
+        metrics[ f"{mode}_init_transfers" ] = len( sim.spi_log )
+
+        # single key change
+        sim.reset_logs()
+        start = time.monotonic_ns()
+        pad.set_color( 0, 255, 0, 0 )
+        pad.show()
+        metrics[ f"{mode}_single_bus_us" ] = round( ( time.monotonic_ns() - start ) / 1000, 1 )
+        metrics[ f"{mode}_single_bytes" ] = sim.spi_bytes
+
+        # repaint key by key
+        sim.reset_logs()
+        began = host_ns()
+        for key in range( 16 ):
+            pad.set_color( key, 0, 0, key * 16 )
+        pad.show()
+        metrics[ f"{mode}_repaint_transfers" ] = len( sim.spi_log )
+        metrics[ f"{mode}_repaint_bytes" ] = sim.spi_bytes
+        metrics[ f"host_{mode}_repaint_us" ] = round( ( host_ns() - began ) / 1000, 1 )
+
+        # bulk repaint
+        sim.reset_logs()
+        pad.set_colors( [ [key * 16, 0, 0] for key in range( 16 ) ] )
+        pad.show()
+        metrics[ f"{mode}_bulk_transfers" ] = len( sim.spi_log )
+        metrics[ f"host_{mode}_init_us" ] = round( host_init / 1000, 1 )
+    return metrics
+
+
+@scenario
+def boot():
+    '''
+    startup time of the pad and the ducky engine, stage by stage, with the host taking
+      120ms to enumerate the keyboard, and the time to the first key event
+    '''
+    metrics = {}
+    sim = fresh( usb_connected=120 )
+    began = host_ns()
+    pad = MacroPad()
+    de = DuckyEngine()
+    metrics[ "host_boot_us" ] = round( ( host_ns() - began ) / 1000, 1 )
+    metrics[ "boot_us" ] = round( time.monotonic_ns() / 1000, 1 )
+    for name, ns in list( pad.boot_times.items() ) + list( de.boot_times.items() ):
+        metrics[ f"{name}_us" ] = round( ns / 1000, 1 )
+
+    # a key already held down at startup
+    sim.keypad.press( 0 )
+    while not pad.update():
+        time.sleep( 0.001 )
+    metrics[ "first_event_us" ] = round( pad.boot_times[ "first_event" ] / 1000, 1 )
+    return metrics
+
+
+@scenario
+def key_heap():
+    '''
+    heap bytes and gc tracked objects taken by a pad and by its 16 key and led objects,
+      and the host time of a full gc pass with the pad alive
+    '''
+    metrics = {}
+    fresh()
+    gc.collect()
+    tracemalloc.start()
+    objects = len( gc.get_objects() )
+    before = tracemalloc.get_traced_memory()[0]
+    pad = MacroPad()
+    metrics[ "pad_bytes" ] = tracemalloc.get_traced_memory()[0] - before
+    metrics[ "pad_gc_objects" ] = len( gc.get_objects() ) - objects
+
+    # a second set of keys on the same pad, to count the keys alone
+    objects = len( gc.get_objects() )
+    before = tracemalloc.get_traced_memory()[0]
+    keys = [ Key( i, pad._framebuffer, pad._scanner ) for i in range( 16 ) ]
+    metrics[ "key_bytes" ] = tracemalloc.get_traced_memory()[0] - before
+    metrics[ "key_gc_objects" ] = len( gc.get_objects() ) - objects
+    tracemalloc.stop()
+
+    began = host_ns()
+    for i in range( 20 ):
+        gc.collect()
+    metrics[ "host_gc_us" ] = round( ( host_ns() - began ) / 20000, 1 )
+    return metrics
+
+
+@scenario
+def layer_switch():
+    '''
+    spi transfers, bytes and host time to change macro sets: dropping and rebinding every
+      key with its color, against switching to a prebuilt layer
+    '''
+    metrics = {}
+    sim = fresh()
+    pad = MacroPad()
+    callbacks = [ ( lambda key=key: key ) for key in range( 16 ) ]
+
+    # rebind every key
+    sim.reset_logs()
+    began = host_ns()
+    for key in range( 16 ):
+        pad.drop_key( key )
+        pad.bind_key( key, callbacks[ key ], color=[0, key * 16, 0] )
+    metrics[ "host_rebind_us" ] = round( ( host_ns() - began ) / 1000, 1 )
+    metrics[ "rebind_transfers" ] = len( sim.spi_log )
+    metrics[ "rebind_bytes" ] = sim.spi_bytes
+
+    # switch between two prebuilt layers
+    pad.add_layer( "other" )
+    for key in range( 16 ):
+        pad.bind_key( key, callbacks[ key ], color=[key * 16, 0, 0], layer="other" )
+    sim.reset_logs()
+    began = host_ns()
+    for i in range( 10 ):
+        pad.switch_layer( "other" if i % 2 == 0 else "base" )
+    metrics[ "host_switch_us" ] = round( ( host_ns() - began ) / 10000, 1 )
+    metrics[ "switch_transfers" ] = len( sim.spi_log ) / 10
+    metrics[ "switch_bytes" ] = sim.spi_bytes / 10
+    return metrics
+
+
+@scenario
+def config_load():
+    '''
+    host time to bind 16 keys from a config file: parsing it and compiling its scripts
+      on the first boot, and loading the compiled config on the next
+    '''
+    metrics = {}
+    path = os.path.join( tempfile.mkdtemp(), "config.json" )
+    keys = { str( key ): { "script": MACRO + f"STRING key {key}", "color": [ 0, key * 16, 0 ] } for key in range( 16 ) }
+    with open( path, "w" ) as outfile:
+        json.dump( { "keys": keys }, outfile )
+
+    for name in ( "source", "compiled" ):
+        fresh()
+        pad = MacroPad()
+        engine = DuckyEngine()
+        began = host_ns()
+        pad.load_config( path, engine )
+        metrics[ f"host_{name}_load_us" ] = round( ( host_ns() - began ) / 1000, 1 )
+    metrics[ "compiled_bytes" ] = os.stat( path + pad_lib.CONFIG_SUFFIX ).st_size
+    metrics[ "source_bytes" ] = os.stat( path ).st_size
+    return metrics
+
+
+def reference_writebytes( dotstar, buffer ):
+    '''
+    the bit-banged write DotStar used before the bit level tables, for comparison
+    '''
+    for b in buffer:
+        for _ in range( 8 ):
+            dotstar.dpin.value = b & 0x80
+            dotstar.cpin.value = True
+            dotstar.cpin.value = False
+            b = b << 1
+    dotstar.cpin.value = False
+
+
+@scenario
+def dotstar_spi():
+    '''
+    bytes per second and pin writes of the bit-banged spi fallback, old loop against
+      the table driven one, and bytes sent by partial updates
+    '''
+    metrics = {}
+    sim = fresh( hardware_spi=False )
+    strip = adafruit_dotstar.DotStar( board.GP18, board.GP19, 16, brightness=0.1, auto_write=False )
+    for i in range( 16 ):
+        strip[i] = ( i * 16, 255 - i * 16, 40 )
+    strip.show()
+    buffer = sim.spi_log and sim.spi_log[-1][1] or bytes( strip._buffer )
+    repeats = 20
+    for name, write in ( ( "reference", lambda: reference_writebytes( strip, buffer ) ), ( "table", lambda: strip._ds_writebytes( buffer ) ) ):
+        sim.reset_logs()
+        began = host_ns()
+        for i in range( repeats ):
+            write()
+        host = host_ns() - began
+        metrics[ f"soft_{name}_pin_writes" ] = sim.pin_writes // repeats
+        metrics[ f"host_soft_{name}_bytes_per_s" ] = round( len( buffer ) * repeats * 1000000000 / host )
+
+    # partial updates on hardware spi: change one pixel near the start and one at the end
+    for partial in ( False, True ):
+        sim = fresh()
+        strip = adafruit_dotstar.DotStar( board.GP18, board.GP19, 16, brightness=0.1, auto_write=False, partial_updates=partial )
+        strip.show()
+        mode = "partial" if partial else "full"
+        for key in ( 1, 15 ):
+            sim.reset_logs()
+            strip[ key ] = ( 255, 0, 0 )
+            strip.show()
+            metrics[ f"{mode}_key{key}_bytes" ] = sim.spi_bytes
+        sim.reset_logs()
+        strip.show()
+        metrics[ f"{mode}_unchanged_bytes" ] = sim.spi_bytes
+    return metrics
+
+
+# 3. Runner ---
+
+def compare( results, baseline, threshold ):
+    '''
+    print the metrics that changed against a previous results file
+    @return int number of regressions beyond the threshold
+    '''
+    regressions = 0
+    for name, metrics in results[ "scenarios" ].items():
+        old_metrics = baseline.get( "scenarios", {} ).get( name, {} )
+        for metric, value in metrics.items():
+            old = old_metrics.get( metric )
+            if not isinstance( old, ( int, float ) ) or not isinstance( value, ( int, float ) ) or old == value:
+                continue
+            change = ( value - old ) / abs( old ) if old else float( "inf" )
+            worse = change < 0 if metric.endswith( HIGHER_IS_BETTER ) else change > 0
+            flag = ""
+            if worse and abs( change ) > threshold and not metric.startswith( "host_" ):
+                flag = "  REGRESSION"
+                regressions += 1
+            print( f"  {name}.{metric}: {old} -> {value} ({change:+.1%}){flag}" )
+    return regressions
+
+
+def main( argv=None ):
+    parser = argparse.ArgumentParser( description="pico keypad benchmarks" )
+    parser.add_argument( "scenarios", nargs="*", help="scenarios to run, all if none given" )
+    parser.add_argument( "-o", "--output", default="bench_results.json", help="where to save the results" )
+    parser.add_argument( "-c", "--compare", help="previous results file to compare against" )
+    parser.add_argument( "-t", "--threshold", type=float, default=0.1, help="relative change counted as a regression" )
+    args = parser.parse_args( argv )
+
+    selected = [ func for func in SCENARIOS if not args.scenarios or func.__name__ in args.scenarios ]
+    results = {
+        "version": ducky_engine.__version__,
+        "python": sys.version.split()[0],
+        "time": _time.strftime( "%Y-%m-%dT%H:%M:%S" ),
+        "scenarios": {},
+    }
+    for func in selected:
+        metrics = func()
+        results[ "scenarios" ][ func.__name__ ] = metrics
+        print( func.__name__ )
+        for metric, value in metrics.items():
+            print( f"  {metric}: {value}" )
+
+    with open( args.output, "w" ) as outfile:
+        json.dump( results, outfile, indent=2, sort_keys=True )
+    print( f"saved {args.output}" )
+
+    if args.compare:
+        with open( args.compare ) as infile:
+            baseline = json.load( infile )
+        print( f"compared to {args.compare}" )
+        if compare( results, baseline, args.threshold ):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit( main() )
@@ -14,47 +14,791 @@ from adafruit_hid.keyboard_layout_us import KeyboardLayoutUS as KeyboardLayout
 from adafruit_hid.keycode import Keycode
 import supervisor
 import time
-import digitalio
-import pwmio
-from board import *
-import board
+import os
+import struct
+
+try:
+    import asyncio
+except ImportError:
+    asyncio = None
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    OrderedDict = dict
+
+# compiled script op codes
+OP_KEYS = 0
+OP_DELAY = 1
+OP_STRING = 2
+OP_PRINT = 3
+OP_DEFAULT_DELAY = 4
+OP_LED = 5
+OP_REPEAT = 6
+OP_TYPE = 7
+# control flow ops, no default delay is slept after these
+OP_SET = 8
+OP_JUMP = 9
+OP_BRANCH = 10
+OP_BLOCK = 11
+OP_VARS = 12
+
+# expression items: a ( kind, value ) pair of a constant, a variable slot, or an index
+# into EXPR_OPERATORS
+EXPR_CONST = 0
+EXPR_VAR = 1
+EXPR_OPERATOR = 2
+
+# expression operators by precedence, "u-" is unary minus
+EXPR_OPERATORS = ( "||", "&&", "==", "!=", "<=", ">=", "<", ">", "+", "-", "*", "/", "%", "u-", "!" )
+EXPR_PRECEDENCE = ( 1, 2, 3, 3, 3, 3, 3, 3, 4, 4, 5, 5, 5, 6, 6 )
+EXPR_FUNCTIONS = (
+    lambda a, b: int( bool( a ) or bool( b ) ),
+    lambda a, b: int( bool( a ) and bool( b ) ),
+    lambda a, b: int( a == b ),
+    lambda a, b: int( a != b ),
+    lambda a, b: int( a <= b ),
+    lambda a, b: int( a >= b ),
+    lambda a, b: int( a < b ),
+    lambda a, b: int( a > b ),
+    lambda a, b: a + b,
+    lambda a, b: a - b,
+    lambda a, b: a * b,
+    lambda a, b: a // b if b else 0,
+    lambda a, b: a % b if b else 0,
+    lambda a, b: a - b,
+    lambda a, b: int( not b ),
+)
+
+# precompiled script files: a header of the magic and the source's size and mtime,
+# then one record per op of the op code, a 2 byte payload length and the payload
+CACHE_SUFFIX = ".dkc"
+CACHE_MAGIC = b"DKC1"
+
+# instrumentation histogram names, by op code
+OP_NAMES = ( "op.keys", "op.delay", "op.string", "op.print", "op.default_delay", "op.led", "op.repeat", "op.type",
+    "op.set", "op.jump", "op.branch", "op.block", "op.vars" )
+
+class CompiledScript:
+    '''
+    A ducky script compiled into a tuple of pre-resolved (op, arg) pairs. Calling it runs
+      it on the engine that compiled it, so it can be bound to a key directly
+    '''
+
+    def __init__( self, engine, ops ):
+        '''
+        :param DuckyEngine engine: engine that compiled the script and runs it
+        :param tuple ops: the compiled (op, arg) pairs
+        '''
+        self.engine = engine
+        self.ops = ops
+
+    def __call__( self, **kwargs ):
+        return self.engine.run_compiled( self )
+
+    def __len__( self ):
+        return len( self.ops )
+
+    @property
+    def nbytes( self ):
+        '''
+        estimate of the RAM the compiled ops take: a fixed cost per op plus its payload
+        '''
+        total = 0
+        pending = list( self.ops )
+        while pending:
+            op, arg = pending.pop()
+            if op == OP_REPEAT:
+                op, arg = arg[1]
+            total += 32
+            if op == OP_BLOCK:
+                pending.extend( arg )
+            elif op == OP_SET or op == OP_BRANCH:
+                total += 16 * len( arg[1] if op == OP_SET else arg[0] )
+            elif op == OP_TYPE:
+                total += len( arg[1] )
+            elif op == OP_KEYS:
+                total += 8 * len( arg )
+            elif op == OP_STRING or op == OP_PRINT:
+                total += len( arg )
+        return total
+
+class ScriptFile:
+    '''
+    A ducky script file on flash, loaded and compiled the first time it's called and
+      afterwards taken from the engine's script cache. Calling it runs the script, so it
+      can be bound to a key directly
+    '''
+
+    def __init__( self, engine, path ):
+        '''
+        :param DuckyEngine engine: engine that loads and runs the script
+        :param str path: path of the script file
+        '''
+        self.engine = engine
+        self.path = path
+
+    def __call__( self, **kwargs ):
+        return self.engine.run_compiled( self.engine.load( self.path ) )
+
+    def __repr__( self ):
+        return f"ScriptFile({self.path!r})"
 
 class DuckyEngine:
     ''' used to interpret/run ducky scripts '''
 
-    def __init__( self ):
+    # seconds to wait for the host to enumerate the usb device before going on anyway
+    USB_TIMEOUT = 0.5
+
+    # longest seconds a running script goes without calling the idle hook
+    IDLE_SLICE = 0.005
+
+    # ms per step of DEFAULT_DELAY n, the pause after every command of a script
+    DEFAULT_DELAY_UNIT_MS = 10
+
+    def __init__( self, report_interval=0, stats=None, cache_bytes=16384, usb_timeout=USB_TIMEOUT ):
+        '''
+        :param float report_interval: minimum seconds between the hid reports of a STRING,
+            0 sends them as fast as the host takes them
+        :param Stats stats: pad_stats.Stats to record op timings in, None to not record
+        :param int cache_bytes: RAM budget for script files compiled by `load`; the least
+            recently run scripts are dropped to stay under it
+        :param float usb_timeout: longest time in seconds to wait for the host to
+            enumerate the keyboard, startup carries on when it does or the time runs out
+        '''
+        # ms paused after every command; each run starts from it and its DEFAULT_DELAY
+        # only changes the pause for the rest of that run
         self.default_delay = 0
-        self.duckyCommands = {
-            'WINDOWS': Keycode.WINDOWS, 'GUI': Keycode.GUI,
-            'APP': Keycode.APPLICATION, 'MENU': Keycode.APPLICATION, 'SHIFT': Keycode.SHIFT,
-            'ALT': Keycode.ALT, 'CONTROL': Keycode.CONTROL, 'CTRL': Keycode.CONTROL,
-            'DOWNARROW': Keycode.DOWN_ARROW, 'DOWN': Keycode.DOWN_ARROW, 'LEFTARROW': Keycode.LEFT_ARROW,
-            'LEFT': Keycode.LEFT_ARROW, 'RIGHTARROW': Keycode.RIGHT_ARROW, 'RIGHT': Keycode.RIGHT_ARROW,
-            'UPARROW': Keycode.UP_ARROW, 'UP': Keycode.UP_ARROW, 'BREAK': Keycode.PAUSE,
-            'PAUSE': Keycode.PAUSE, 'CAPSLOCK': Keycode.CAPS_LOCK, 'DELETE': Keycode.DELETE,
-            'END': Keycode.END, 'ESC': Keycode.ESCAPE, 'ESCAPE': Keycode.ESCAPE, 'HOME': Keycode.HOME,
-            'INSERT': Keycode.INSERT, 'NUMLOCK': Keycode.KEYPAD_NUMLOCK, 'PAGEUP': Keycode.PAGE_UP,
-            'PAGEDOWN': Keycode.PAGE_DOWN, 'PRINTSCREEN': Keycode.PRINT_SCREEN, 'ENTER': Keycode.ENTER,
-            'SCROLLLOCK': Keycode.SCROLL_LOCK, 'SPACE': Keycode.SPACE, 'TAB': Keycode.TAB,
-            'BACKSPACE': Keycode.BACKSPACE,
-            'A': Keycode.A, 'B': Keycode.B, 'C': Keycode.C, 'D': Keycode.D, 'E': Keycode.E,
-            'F': Keycode.F, 'G': Keycode.G, 'H': Keycode.H, 'I': Keycode.I, 'J': Keycode.J,
-            'K': Keycode.K, 'L': Keycode.L, 'M': Keycode.M, 'N': Keycode.N, 'O': Keycode.O,
-            'P': Keycode.P, 'Q': Keycode.Q, 'R': Keycode.R, 'S': Keycode.S, 'T': Keycode.T,
-            'U': Keycode.U, 'V': Keycode.V, 'W': Keycode.W, 'X': Keycode.X, 'Y': Keycode.Y,
-            'Z': Keycode.Z, 'F1': Keycode.F1, 'F2': Keycode.F2, 'F3': Keycode.F3,
-            'F4': Keycode.F4, 'F5': Keycode.F5, 'F6': Keycode.F6, 'F7': Keycode.F7,
-            'F8': Keycode.F8, 'F9': Keycode.F9, 'F10': Keycode.F10, 'F11': Keycode.F11,
-            'F12': Keycode.F12,
-        }
-        self.kbd = Keyboard( usb_hid.devices )
-        self.layout = KeyboardLayout( self.kbd )
+        self.stats = stats
+        self.report_interval = report_interval
+        self.typing_stats = ( 0, 0 )
+
+        # ( waits, late waits, total ns late, most ns late ) of the last run to end
+        self.drift_stats = ( 0, 0, 0, 0 )
+        self.boot_times = {}
+        self.led = None
+
+        # called while a script runs, e.g. MacroPad.poll; returning True stops the script
+        self.idle = None
+        self._ducky_commands = None
+        self._char_keycodes = None
+        self._compiled = {}
+        self.cache_bytes = cache_bytes
+        self._file_cache = OrderedDict()
+        self._file_cache_bytes = 0
+        self._report = bytearray( 8 )
 
         # init some modules
         supervisor.disable_autoreload()
 
-        # sleep to allow the device to register on the host
-        time.sleep(.5)
+        # wait for the device to register on the host, then open the keyboard
+        started = time.monotonic_ns()
+        self.wait_for_usb( usb_timeout )
+        started = self._boot_stage( "usb", started )
+        self.kbd = Keyboard( usb_hid.devices )
+        self.layout = KeyboardLayout( self.kbd )
+        self._boot_stage( "hid", started )
+
+    def _boot_stage( self, name, started ):
+        '''
+        record how long a startup stage took
+        @return int now, when the next stage starts
+        '''
+        now = time.monotonic_ns()
+        self.boot_times[ name ] = now - started
+        if self.stats is not None:
+            self.stats.record( f"boot.{name}", now - started )
+        return now
+
+    @property
+    def duckyCommands( self ):
+        '''
+        ducky key names to keycodes, built the first time a script needs it
+        '''
+        if self._ducky_commands is None:
+            commands = {
+                'WINDOWS': Keycode.WINDOWS, 'GUI': Keycode.GUI,
+                'APP': Keycode.APPLICATION, 'MENU': Keycode.APPLICATION, 'SHIFT': Keycode.SHIFT,
+                'ALT': Keycode.ALT, 'CONTROL': Keycode.CONTROL, 'CTRL': Keycode.CONTROL,
+                'DOWNARROW': Keycode.DOWN_ARROW, 'DOWN': Keycode.DOWN_ARROW, 'LEFTARROW': Keycode.LEFT_ARROW,
+                'LEFT': Keycode.LEFT_ARROW, 'RIGHTARROW': Keycode.RIGHT_ARROW, 'RIGHT': Keycode.RIGHT_ARROW,
+                'UPARROW': Keycode.UP_ARROW, 'UP': Keycode.UP_ARROW, 'BREAK': Keycode.PAUSE,
+                'PAUSE': Keycode.PAUSE, 'CAPSLOCK': Keycode.CAPS_LOCK, 'DELETE': Keycode.DELETE,
+                'END': Keycode.END, 'ESC': Keycode.ESCAPE, 'ESCAPE': Keycode.ESCAPE, 'HOME': Keycode.HOME,
+                'INSERT': Keycode.INSERT, 'NUMLOCK': Keycode.KEYPAD_NUMLOCK, 'PAGEUP': Keycode.PAGE_UP,
+                'PAGEDOWN': Keycode.PAGE_DOWN, 'PRINTSCREEN': Keycode.PRINT_SCREEN, 'ENTER': Keycode.ENTER,
+                'SCROLLLOCK': Keycode.SCROLL_LOCK, 'SPACE': Keycode.SPACE, 'TAB': Keycode.TAB,
+                'BACKSPACE': Keycode.BACKSPACE,
+                'A': Keycode.A, 'B': Keycode.B, 'C': Keycode.C, 'D': Keycode.D, 'E': Keycode.E,
+                'F': Keycode.F, 'G': Keycode.G, 'H': Keycode.H, 'I': Keycode.I, 'J': Keycode.J,
+                'K': Keycode.K, 'L': Keycode.L, 'M': Keycode.M, 'N': Keycode.N, 'O': Keycode.O,
+                'P': Keycode.P, 'Q': Keycode.Q, 'R': Keycode.R, 'S': Keycode.S, 'T': Keycode.T,
+                'U': Keycode.U, 'V': Keycode.V, 'W': Keycode.W, 'X': Keycode.X, 'Y': Keycode.Y,
+                'Z': Keycode.Z, 'F1': Keycode.F1, 'F2': Keycode.F2, 'F3': Keycode.F3,
+                'F4': Keycode.F4, 'F5': Keycode.F5, 'F6': Keycode.F6, 'F7': Keycode.F7,
+                'F8': Keycode.F8, 'F9': Keycode.F9, 'F10': Keycode.F10, 'F11': Keycode.F11,
+                'F12': Keycode.F12,
+            }
+            self._ducky_commands = commands
+        return self._ducky_commands
+
+    def wait_for_usb( self, timeout=USB_TIMEOUT ):
+        '''
+        poll until the host has enumerated the usb device, or timeout seconds pass
+        :param float timeout: longest time to wait in seconds
+        @return bool True if usb is connected
+        '''
+        deadline = time.monotonic_ns() + int( timeout * 1000000000 )
+        while not supervisor.runtime.usb_connected:
+            if time.monotonic_ns() >= deadline:
+                return False
+            time.sleep( 0.01 )
+        return True
+
+    def _build_char_table( self ):
+        '''
+        resolve every ascii character the layout can type into a (modifier bits,
+          keycode) pair once, so STRING payloads are encoded without layout lookups.
+          Built the first time a STRING is compiled
+        '''
+        self._char_modifiers = bytearray( 128 )
+        self._char_keycodes = bytearray( 128 )
+        for i in range( 128 ):
+            try:
+                keycodes = self.layout.keycodes( chr(i) )
+            except ValueError:
+                continue
+            modifiers = 0
+            for keycode in keycodes:
+                bit = Keycode.modifier_bit( keycode )
+                if bit:
+                    modifiers |= bit
+                else:
+                    self._char_keycodes[i] = keycode
+            self._char_modifiers[i] = modifiers
+
+    @property
+    def chars_per_second( self ):
+        '''
+        typing speed of the last STRING sent as encoded reports
+        '''
+        chars, ns = self.typing_stats
+        if not ns:
+            return 0
+        return chars * 1000000000 / ns
+
+    def compile( self, script ):
+        '''
+        compile a multiline ducky script into a CompiledScript. Scripts are cached by
+          their text, so compiling the same script again costs a dict lookup
+        :param str script: the ducky script
+        @return CompiledScript
+        '''
+        compiled = self._compiled.get( script )
+        if compiled is None:
+            compiled = CompiledScript( self, self.compile_lines( script.split( "\n" ) ) )
+            self._compiled[ script ] = compiled
+        return compiled
+
+    def load( self, path ):
+        '''
+        compile a script file, or take it from the script cache. Cached scripts are
+          checked against the file's size and modification time, so an edited file is
+          compiled again. The file is compiled line by line without reading it whole. A
+          script bigger than cache_bytes is compiled on every load and never cached
+        :param str path: path of the script file
+        @return CompiledScript
+        '''
+        stat = os.stat( path )
+        stamp = ( stat[6], stat[8] )
+        cache = self._file_cache
+        entry = cache.pop( path, None )
+        if entry is not None:
+            if entry[0] == stamp:
+                # move to the most recently used end
+                cache[ path ] = entry
+                if self.stats is not None:
+                    self.stats.count( "scripts.hits" )
+                return entry[1]
+            self._file_cache_bytes -= entry[2]
+
+        with open( path, "r", encoding="utf-8" ) as infile:
+            compiled = CompiledScript( self, self.compile_lines( infile ) )
+        nbytes = compiled.nbytes
+        if self.stats is not None:
+            self.stats.count( "scripts.misses" )
+        if nbytes > self.cache_bytes:
+            # bigger than the whole cache, run it without evicting everything else
+            return compiled
+
+        # drop the least recently used scripts until the new one fits
+        while cache and self._file_cache_bytes + nbytes > self.cache_bytes:
+            oldest = next( iter( cache ) )
+            self._file_cache_bytes -= cache.pop( oldest )[2]
+            if self.stats is not None:
+                self.stats.count( "scripts.evictions" )
+        cache[ path ] = ( stamp, compiled, nbytes )
+        self._file_cache_bytes += nbytes
+        return compiled
+
+    def script_file( self, path ):
+        '''
+        a callable that loads a script file on its first call and runs it, for binding
+          payloads kept on the CIRCUITPY drive without keeping them all in RAM
+        :param str path: path of the script file
+        @return ScriptFile
+        '''
+        return ScriptFile( self, path )
+
+    @property
+    def cached_scripts( self ):
+        '''
+        paths of the compiled script files in the cache, least recently used first
+        '''
+        return list( self._file_cache )
+
+    def compile_line( self, line ):
+        '''
+        compile a single line into an (op, arg) pair, None for lines that do nothing
+        '''
+        if line[0:3] == "REM":
+            return None
+        elif line[0:5] == "DELAY":
+            return ( OP_DELAY, float(line[6:]) )
+        elif line[0:6] == "STRING":
+            reports = self.encode_string( line[7:] )
+            if reports is None:
+                return ( OP_STRING, line[7:] )
+            return ( OP_TYPE, ( len( line[7:] ), reports ) )
+        elif line[0:5] == "PRINT":
+            return ( OP_PRINT, f"[SCRIPT]: {line[6:]}" )
+        elif line[0:13] == "DEFAULT_DELAY":
+            return ( OP_DEFAULT_DELAY, int( line[14:] ) * self.DEFAULT_DELAY_UNIT_MS )
+        elif line[0:12] == "DEFAULTDELAY":
+            return ( OP_DEFAULT_DELAY, int( line[13:] ) * self.DEFAULT_DELAY_UNIT_MS )
+        elif line[0:3] == "LED":
+            return ( OP_LED, None )
+        return ( OP_KEYS, tuple( self.convert_line( line ) ) )
+
+    def compile_lines( self, lines ):
+        '''
+        compile an iterable of script lines, skipping blank lines and comments
+        @return tuple of (op, arg) pairs
+        '''
+        return tuple( self.iter_ops( lines ) )
+
+    def iter_ops( self, lines ):
+        '''
+        compile an iterable of script lines one line at a time, yielding each (op, arg)
+          pair as soon as its line is compiled. An IF, WHILE or FOR block is yielded as a
+          single OP_BLOCK once its END_IF, END_WHILE or END_FOR is read, holding its ops
+          with jumps relative to the block, so only open blocks are held in memory. Before
+          the first op that uses a newly declared variable comes an OP_VARS of the number
+          of variables declared so far, for the run to make room for them
+        '''
+        names = {}
+        declared = 0
+        blocks = []
+        previous = None
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            word = line.split( None, 1 )[0]
+            if word == "IF" or word == "WHILE" or word == "FOR":
+                blocks.append( self._open_block( word, line[len(word):], names ) )
+                previous = None
+                continue
+            elif word == "ELSE":
+                if not blocks or blocks[-1][0] != "IF" or blocks[-1][2] is None:
+                    raise Exception( f"ELSE without an IF: {line}" )
+                self._else_block( blocks[-1], line[4:], names )
+                previous = None
+                continue
+            elif word == "END_IF" or word == "END_WHILE" or word == "END_FOR":
+                if not blocks or word != "END_" + blocks[-1][0]:
+                    raise Exception( f"{word} without a matching {word[4:]}" )
+                op = ( OP_BLOCK, self._close_block( blocks.pop() ) )
+            elif word == "VAR" or word[0] == "$":
+                op = self.compile_assignment( line, names )
+            elif word == "REPEAT":
+                if previous is None:
+                    continue
+                op = ( OP_REPEAT, ( int(line[7:]), previous ) )
+            else:
+                op = self.compile_line( line )
+                if op is None:
+                    continue
+            if op[0] != OP_REPEAT:
+                previous = op
+            if blocks:
+                blocks[-1][1].append( op )
+                continue
+            if len( names ) > declared:
+                declared = len( names )
+                yield ( OP_VARS, declared )
+            yield op
+        if blocks:
+            raise Exception( f"{blocks[-1][0]} without an END_{blocks[-1][0]}" )
+
+    def compile_assignment( self, line, names ):
+        '''
+        compile a `VAR $name = expression` declaration or a `$name = expression`
+          assignment into an OP_SET of the variable's slot
+        :param dict names: variable name to slot, the script's variables so far
+        '''
+        declare = line[0:4] == "VAR "
+        if declare:
+            line = line[4:]
+        name, equals, text = line.partition( "=" )
+        name = name.strip()
+        if not equals or name[0:1] != "$" or len( name ) < 2:
+            raise Exception( f"Bad assignment: {line}" )
+        if name not in names:
+            if not declare:
+                raise Exception( f"Unknown variable {name}, declare it with VAR" )
+            names[ name ] = len( names )
+        return ( OP_SET, ( names[ name ], self.compile_expression( text, names ) ) )
+
+    def compile_expression( self, text, names ):
+        '''
+        compile an integer expression of numbers, TRUE, FALSE, $variables, parentheses
+          and the EXPR_OPERATORS into a tuple of postfix ( kind, value ) items
+        :param dict names: variable name to slot
+        '''
+        out = []
+        operators = []
+        operand = True
+        i = 0
+        while i < len( text ):
+            char = text[i]
+            if char == " ":
+                i += 1
+            elif char == "(":
+                operators.append( None )
+                i += 1
+            elif char == ")":
+                while operators and operators[-1] is not None:
+                    out.append( ( EXPR_OPERATOR, operators.pop() ) )
+                if not operators:
+                    raise Exception( f"Unbalanced ) in {text}" )
+                operators.pop()
+                operand = False
+                i += 1
+            elif operand and ( char == "-" or char == "!" ):
+                # unary, applied to a 0 left hand side
+                out.append( ( EXPR_CONST, 0 ) )
+                operators.append( EXPR_OPERATORS.index( "u-" if char == "-" else "!" ) )
+                i += 1
+            elif operand:
+                start = i
+                while i < len( text ) and ( text[i].isalpha() or text[i].isdigit() or text[i] in "$_" ):
+                    i += 1
+                token = text[start:i]
+                if token.isdigit():
+                    out.append( ( EXPR_CONST, int( token ) ) )
+                elif token in ( "TRUE", "FALSE" ):
+                    out.append( ( EXPR_CONST, int( token == "TRUE" ) ) )
+                elif token in names:
+                    out.append( ( EXPR_VAR, names[ token ] ) )
+                else:
+                    raise Exception( f"Unknown value {token or char} in {text}" )
+                operand = False
+            else:
+                if text[i:i+2] in EXPR_OPERATORS:
+                    token = text[i:i+2]
+                elif char in EXPR_OPERATORS:
+                    token = char
+                else:
+                    raise Exception( f"Unknown operator {char} in {text}" )
+                index = EXPR_OPERATORS.index( token )
+                while operators and operators[-1] is not None and EXPR_PRECEDENCE[ operators[-1] ] >= EXPR_PRECEDENCE[ index ]:
+                    out.append( ( EXPR_OPERATOR, operators.pop() ) )
+                operators.append( index )
+                operand = True
+                i += len( token )
+        if operand:
+            raise Exception( f"Incomplete expression: {text}" )
+        while operators:
+            index = operators.pop()
+            if index is None:
+                raise Exception( f"Unbalanced ( in {text}" )
+            out.append( ( EXPR_OPERATOR, index ) )
+        return tuple( out )
+
+    def _open_block( self, kind, text, names ):
+        '''
+        start compiling a block
+        @return list [ kind, ops, index of the branch still to be pointed past its
+            code, indexes of the jumps to point at the end ]
+        '''
+        text = text.strip()
+        if text[-4:] == "THEN":
+            text = text[:-4]
+        if kind != "FOR":
+            return [ kind, [ ( OP_BRANCH, ( self.compile_expression( text, names ), None ) ) ], 0, [] ]
+
+        # FOR n counts a hidden variable down from n
+        slot = len( names )
+        names[ f"#{slot}" ] = slot
+        more = ( ( EXPR_VAR, slot ), ( EXPR_CONST, 0 ), ( EXPR_OPERATOR, EXPR_OPERATORS.index( ">" ) ) )
+        return [ kind, [ ( OP_SET, ( slot, self.compile_expression( text, names ) ) ), ( OP_BRANCH, ( more, None ) ) ], 1, [] ]
+
+    def _else_block( self, block, text, names ):
+        ops = block[1]
+        block[3].append( len( ops ) )
+        ops.append( ( OP_JUMP, None ) )
+        branch = block[2]
+        ops[ branch ] = ( OP_BRANCH, ( ops[ branch ][1][0], len( ops ) ) )
+        text = text.strip()
+        if text[0:2] == "IF":
+            # ELSE IF, a new condition for the rest of the block
+            text = text[2:].strip()
+            if text[-4:] == "THEN":
+                text = text[:-4]
+            block[2] = len( ops )
+            ops.append( ( OP_BRANCH, ( self.compile_expression( text, names ), None ) ) )
+        else:
+            block[2] = None
+
+    def _close_block( self, block ):
+        '''
+        finish a block, pointing its jumps
+        @return tuple of its (op, arg) pairs
+        '''
+        kind, ops, branch, jumps = block
+        if kind == "WHILE":
+            ops.append( ( OP_JUMP, 0 ) )
+        elif kind == "FOR":
+            slot = ops[0][1][0]
+            ops.append( ( OP_SET, ( slot, ( ( EXPR_VAR, slot ), ( EXPR_CONST, 1 ), ( EXPR_OPERATOR, EXPR_OPERATORS.index( "-" ) ) ) ) ) )
+            ops.append( ( OP_JUMP, 1 ) )
+        end = len( ops )
+        if branch is not None:
+            ops[ branch ] = ( OP_BRANCH, ( ops[ branch ][1][0], end ) )
+        for i in jumps:
+            ops[i] = ( OP_JUMP, end )
+        return tuple( ops )
+
+    def evaluate( self, expr, variables ):
+        '''
+        evaluate a compiled expression
+        :param list variables: the running script's variables by slot
+        @return int
+        '''
+        if len( expr ) == 1:
+            kind, value = expr[0]
+            return value if kind == EXPR_CONST else variables[ value ]
+        stack = []
+        for kind, value in expr:
+            if kind == EXPR_CONST:
+                stack.append( value )
+            elif kind == EXPR_VAR:
+                stack.append( variables[ value ] )
+            else:
+                b = stack.pop()
+                stack.append( EXPR_FUNCTIONS[ value ]( stack.pop(), b ) )
+        return stack[0]
+
+    def encode_op( self, op, arg ):
+        '''
+        encode an (op, arg) pair as a precompiled file record. A REPEAT record only holds
+          its count, it repeats the record before it
+        @return bytes, or None if the op doesn't fit in a record
+        '''
+        if op == OP_KEYS:
+            payload = bytes( arg )
+        elif op == OP_DELAY:
+            if not -3.4e38 < arg < 3.4e38:
+                return None
+            payload = struct.pack( "<f", arg )
+        elif op == OP_TYPE:
+            if arg[0] > 0xFFFF:
+                return None
+            payload = struct.pack( "<H", arg[0] ) + arg[1]
+        elif op == OP_STRING or op == OP_PRINT:
+            payload = arg.encode( "utf-8" )
+        elif op == OP_DEFAULT_DELAY:
+            if not 0 <= arg <= 0xFFFFFFFF:
+                return None
+            payload = struct.pack( "<I", arg )
+        elif op == OP_REPEAT:
+            if arg[0] > 0xFFFF:
+                return None
+            payload = struct.pack( "<H", arg[0] )
+        elif op == OP_SET or op == OP_BRANCH:
+            slot, expr = arg if op == OP_SET else ( arg[1], arg[0] )
+            expr = self._encode_expression( expr )
+            if slot > 0xFFFF or expr is None:
+                return None
+            payload = struct.pack( "<H", slot ) + expr
+        elif op == OP_JUMP or op == OP_VARS:
+            if arg > 0xFFFF:
+                return None
+            payload = struct.pack( "<H", arg )
+        elif op == OP_BLOCK:
+            payload = self._encode_records( arg )
+            if payload is None:
+                return None
+        else:
+            payload = b""
+        if len( payload ) > 0xFFFF:
+            return None
+        return struct.pack( "<BH", op, len( payload ) ) + payload
+
+    def decode_op( self, op, payload ):
+        '''
+        decode the payload of a precompiled file record, other than REPEAT
+        @return (op, arg) pair
+        '''
+        if op == OP_KEYS:
+            return ( op, tuple( payload ) )
+        elif op == OP_DELAY:
+            return ( op, struct.unpack( "<f", payload )[0] )
+        elif op == OP_TYPE:
+            return ( op, ( payload[0] | payload[1] << 8, payload[2:] ) )
+        elif op == OP_STRING or op == OP_PRINT:
+            return ( op, str( payload, "utf-8" ) )
+        elif op == OP_DEFAULT_DELAY:
+            return ( op, struct.unpack( "<I", payload )[0] )
+        elif op == OP_SET:
+            return ( op, ( payload[0] | payload[1] << 8, self._decode_expression( payload ) ) )
+        elif op == OP_JUMP or op == OP_VARS:
+            return ( op, payload[0] | payload[1] << 8 )
+        elif op == OP_BRANCH:
+            return ( op, ( self._decode_expression( payload ), payload[0] | payload[1] << 8 ) )
+        elif op == OP_BLOCK:
+            return ( op, self._decode_records( payload ) )
+        return ( op, None )
+
+    def _encode_expression( self, expr ):
+        # None if a constant doesn't fit the 4 byte signed value
+        out = bytearray()
+        for kind, value in expr:
+            if not -0x80000000 <= value <= 0x7FFFFFFF:
+                return None
+            out += struct.pack( "<Bi", kind, value )
+        return bytes( out )
+
+    def _decode_expression( self, payload ):
+        # the items follow a 2 byte slot or target
+        return tuple( struct.unpack_from( "<Bi", payload, i ) for i in range( 2, len( payload ), 5 ) )
+
+    def encode_script( self, script ):
+        '''
+        encode a CompiledScript as precompiled file records, for keeping it on flash
+        @return bytes, or None if an op doesn't fit in a record
+        '''
+        return self._encode_records( script.ops )
+
+    def decode_script( self, data ):
+        '''
+        rebuild a CompiledScript from the records made by `encode_script`
+        @return CompiledScript
+        '''
+        return CompiledScript( self, self._decode_records( data ) )
+
+    def _encode_records( self, ops ):
+        out = bytearray()
+        for op, arg in ops:
+            record = self.encode_op( op, arg )
+            if record is None:
+                return None
+            out += record
+        return bytes( out )
+
+    def _decode_records( self, data ):
+        ops = []
+        previous = None
+        i = 0
+        while i + 3 <= len( data ):
+            op = data[i]
+            end = i + 3 + ( data[i+1] | data[i+2] << 8 )
+            payload = data[i+3:end]
+            i = end
+            if op == OP_REPEAT:
+                ops.append( ( OP_REPEAT, ( payload[0] | payload[1] << 8, previous ) ) )
+            else:
+                previous = self.decode_op( op, payload )
+                ops.append( previous )
+        return tuple( ops )
+
+    def stream_file( self, filename ):
+        '''
+        yield the ops of a script file one at a time, holding a single line or record in
+          memory. Ops are read from the precompiled file next to the script (the name
+          plus CACHE_SUFFIX) when it was made from a file of the same size and mtime.
+          Otherwise the script is compiled as it's read, and the precompiled file is
+          written alongside if the drive is writable
+        :param str filename: path of the script file
+        '''
+        stat = os.stat( filename )
+        stamp = struct.pack( "<4sII", CACHE_MAGIC, stat[6], stat[8] & 0xFFFFFFFF )
+        cache_path = filename + CACHE_SUFFIX
+        try:
+            infile = open( cache_path, "rb" )
+        except OSError:
+            infile = None
+        if infile is not None:
+            with infile:
+                if infile.read( len( stamp ) ) == stamp:
+                    if self.stats is not None:
+                        self.stats.count( "scripts.precompiled" )
+                    yield from self._read_records( infile )
+                    return
+        yield from self._compile_file( filename, cache_path, stamp )
+
+    def _read_records( self, infile ):
+        header = bytearray( 3 )
+        previous = None
+        while infile.readinto( header ) == 3:
+            op = header[0]
+            payload = infile.read( header[1] | header[2] << 8 )
+            if op == OP_REPEAT:
+                yield ( OP_REPEAT, ( payload[0] | payload[1] << 8, previous ) )
+            else:
+                previous = self.decode_op( op, payload )
+                yield previous
+
+    def _compile_file( self, filename, cache_path, stamp ):
+        # write the records to a temporary file, renamed into place once complete
+        temp_path = cache_path + ".tmp"
+        try:
+            out = open( temp_path, "wb" )
+            out.write( stamp )
+        except OSError:
+            # read only drive, run without writing
+            out = None
+        complete = False
+        try:
+            with open( filename, "r", encoding="utf-8" ) as infile:
+                for op in self.iter_ops( infile ):
+                    if out is not None:
+                        record = self.encode_op( op[0], op[1] )
+                        try:
+                            if record is None:
+                                raise OSError( "op too long for a record" )
+                            out.write( record )
+                        except OSError:
+                            out.close()
+                            os.remove( temp_path )
+                            out = None
+                    yield op
+            complete = True
+        finally:
+            if out is not None:
+                out.close()
+                try:
+                    if complete:
+                        try:
+                            os.remove( cache_path )
+                        except OSError:
+                            pass
+                        os.rename( temp_path, cache_path )
+                    else:
+                        os.remove( temp_path )
+                except OSError:
+                    pass
 
     def convert_line( self, line ):
         newline = []
@@ -73,52 +817,112 @@ class DuckyEngine:
                 print( f"Unknown key: <{key}>" )
         return newline
 
+    def encode_string( self, text ):
+        '''
+        encode text into (modifier bits, keycode) report pairs. Each key is pressed in
+          the same report that releases the one before it, with a release report only
+          in between repeated keys or a change of modifiers, and one at the end
+        :param str text: the text to type
+        @return bytes, or None if the text has characters the layout can't type
+        '''
+        if self._char_keycodes is None:
+            self._build_char_table()
+        modifiers = self._char_modifiers
+        keycodes = self._char_keycodes
+        reports = bytearray()
+        last_modifier = 0
+        last_keycode = 0
+        for char in text:
+            i = ord( char )
+            if i >= 128 or not keycodes[i]:
+                return None
+            modifier = modifiers[i]
+            keycode = keycodes[i]
+            if last_keycode and ( keycode == last_keycode or modifier != last_modifier ):
+                reports.append( 0 )
+                reports.append( 0 )
+            reports.append( modifier )
+            reports.append( keycode )
+            last_modifier = modifier
+            last_keycode = keycode
+        reports.append( 0 )
+        reports.append( 0 )
+        return bytes( reports )
+
     def get_programming_status( self ):
+        import board
+        import digitalio
+
         # check GP0 for setup mode
         # see setup mode for instructions
-        progStatusPin = digitalio.DigitalInOut(GP0)
+        progStatusPin = digitalio.DigitalInOut(board.GP0)
         progStatusPin.switch_to_input(pull=digitalio.Pull.UP)
         return not progStatusPin.value
 
     def parse_line( self, line ):
-        if line[0:3] == "REM":
-            pass
-        elif line[0:5] == "DELAY":
-            time.sleep( float(line[6:])/1000 )
-        elif line[0:6] == "STRING":
-            self.layout.write( line[7:] )
-        elif line[0:5] == "PRINT":
-            print( f"[SCRIPT]: {line[6:]}" )
-        elif line[0:13] == "DEFAULT_DELAY":
-            self.default_delay = int( line[14:] ) * 10
-        elif line[0:13] == "DEFAULTDELAY":
-            self.default_delay = int( line[13:] ) * 10
-        elif line[0:3] == "LED":
-            if self.led.value:
-                self.led.value = False
-            else:
-                self.led.value = True
-        else:
-            new_script_line = self.convert_line( line )
-            self.run_line( new_script_line )
+        op = self.compile_line( line )
+        if op is not None:
+            self.run_op( op[0], op[1] )
 
     def run_file( self, filename ):
+        '''
+        run a script file straight from flash with `stream_file`, so memory use doesn't
+          grow with the size of the file
+        '''
         try:
-            with open( filename, "r", encoding="utf-8" ) as infile:
-                previous = ""
-                for line in infile:
-                    line = line.rstrip()
-                    if line[0:6] == "REPEAT":
-                        for i in range( int(line[7:]) ):
-                            # repeat the last command
-                            self.parse_line( previous )
-                            self.sleep()
-                    else:
-                        self.parse_line( line )
-                        previous = line
-                    self.sleep()
+            self.run_ops( self.stream_file( filename ) )
         except OSError:
-            print("Unable to open file ", file)
+            print( "Unable to open file ", filename )
+
+    def run_compiled( self, script ):
+        '''
+        run a CompiledScript, sleeping the default delay after every op
+        @return bool False if the idle hook stopped the script
+        '''
+        return self.run_ops( script.ops )
+
+    def run_ops( self, ops, variables=None ):
+        '''
+        run an iterable of (op, arg) pairs, sleeping the default delay after every op
+          other than control flow
+        :param list variables: the script's variables by slot, a new script's if not given
+        @return bool False if the idle hook stopped the script
+        '''
+        if variables is None:
+            variables = []
+        run_op = self.run_op
+        timeline = self._start_timeline()
+        try:
+            for op, arg in ops:
+                if run_op( op, arg, variables, timeline ) or ( op < OP_SET and self.sleep( timeline ) ):
+                    return False
+        finally:
+            self._end_timeline( timeline )
+        return True
+
+    def run_block( self, ops, variables, timeline=None ):
+        '''
+        run the ops of an OP_BLOCK, following its jumps. The idle hook gets a turn every
+          time a loop goes round
+        :param list timeline: the running script's timeline from `_start_timeline`
+        @return bool True if the idle hook asked for the script to stop
+        '''
+        run_op = self.run_op
+        pc = 0
+        end = len( ops )
+        while pc < end:
+            op, arg = ops[pc]
+            pc += 1
+            if op == OP_BRANCH:
+                if not self.evaluate( arg[0], variables ):
+                    pc = arg[1]
+            elif op == OP_JUMP:
+                if arg < pc and self.idle is not None and self.idle():
+                    return True
+                pc = arg
+            elif run_op( op, arg, variables, timeline ) or ( op < OP_SET and self.sleep( timeline ) ):
+                return True
+        return False
 
     def run_line( self, line ):
         for k in line:
@@ -126,27 +930,270 @@ class DuckyEngine:
         self.kbd.release_all()
 
     def run_multiline_string( self, in_str ):
-        # parse for each line
-        split_lines = in_str.split( "\n" )
-        lines = []
-        for line in split_lines:
-            if line:
-                lines.append( line.strip() )
-
-        # run each line
-        previous = ""
-        for line in lines:
-            line = line.rstrip()
-            if line[0:6] == "REPEAT":
-                for i in range( int(line[7:]) ):
-                    # repeat the last command
-                    self.parse_line( previous )
-                    self.sleep()
+        self.run_compiled( self.compile( in_str ) )
+
+    def run_op( self, op, arg, variables=None, timeline=None ):
+        '''
+        run a single compiled op
+        :param list variables: the running script's variables by slot
+        :param list timeline: the running script's timeline, None outside a run
+        @return bool True if the idle hook asked for the script to stop
+        '''
+        if self.stats is not None:
+            started = time.monotonic_ns()
+            stop = self._run_op( op, arg, variables, timeline )
+            self.stats.record( OP_NAMES[ op ], time.monotonic_ns() - started )
+            return stop
+        return self._run_op( op, arg, variables, timeline )
+
+    def _run_op( self, op, arg, variables, timeline ):
+        if op == OP_KEYS:
+            self.run_line( arg )
+        elif op == OP_DELAY:
+            return self.wait( arg / 1000, timeline )
+        elif op == OP_TYPE:
+            return self.type_reports( arg[0], arg[1] )
+        elif op == OP_STRING:
+            self.layout.write( arg )
+        elif op == OP_PRINT:
+            print( arg )
+        elif op == OP_DEFAULT_DELAY:
+            if timeline is None:
+                self.default_delay = arg
+            else:
+                timeline[5] = arg
+        elif op == OP_LED:
+            if self.led is not None:
+                self.led.value = not self.led.value
+        elif op == OP_SET:
+            variables[ arg[0] ] = self.evaluate( arg[1], variables )
+        elif op == OP_VARS:
+            # room for the variables declared so far, all starting at 0
+            variables.extend( [ 0 ] * ( arg - len( variables ) ) )
+        elif op == OP_BLOCK:
+            return self.run_block( arg, variables, timeline )
+        elif op == OP_REPEAT:
+            count, ( op, arg ) = arg
+            for i in range( count ):
+                # repeat the last command
+                if self.run_op( op, arg, variables, timeline ) or ( op < OP_SET and self.sleep( timeline ) ):
+                    return True
+
+    def sleep( self, timeline=None ):
+        delay = self.default_delay if timeline is None else timeline[5]
+        return self.wait( float(delay) / 1000, timeline )
+
+    def _start_timeline( self ):
+        '''
+        a new run's timeline. Every run keeps its own, so scripts running at the same
+          time on one engine don't move each other's delays or change each other's
+          default delay
+        @return list [ deadline ns, waits, late waits, total ns late, most ns late,
+            default delay ms ]
+        '''
+        return [ time.monotonic_ns(), 0, 0, 0, 0, self.default_delay ]
+
+    def _end_timeline( self, timeline ):
+        self.drift_stats = tuple( timeline[1:5] )
+
+    def _advance( self, seconds, timeline ):
+        '''
+        move a run's timeline on by seconds, counting late delays
+        @return int ns deadline to sleep until
+        '''
+        now = time.monotonic_ns()
+        if timeline is None:
+            return now + int( seconds * 1000000000 )
+        deadline = timeline[0] + int( seconds * 1000000000 )
+        timeline[1] += 1
+        late = now - deadline
+        if late > 0:
+            timeline[2] += 1
+            timeline[3] += late
+            if late > timeline[4]:
+                timeline[4] = late
+            if self.stats is not None:
+                self.stats.record( "delay.late", late )
+            deadline = now
+        timeline[0] = deadline
+        return deadline
+
+    def wait( self, seconds, timeline=None ):
+        '''
+        sleep until the running script's timeline has moved on by seconds, calling the
+          idle hook at least every IDLE_SLICE seconds if there is one. The timeline
+          starts with the run and only moves by delays, so the time spent typing between
+          two delays comes out of the second instead of adding to it, and a script keeps
+          the same pace however long its reports take. A delay whose end has already
+          passed is counted as late in drift_stats, and the timeline restarts from now
+          rather than rushing through the delays after it. Outside a run the delay
+          counts from now
+        :param list timeline: the running script's timeline, None outside a run
+        @return bool True if the idle hook asked for the script to stop
+        '''
+        idle = self.idle
+        if seconds <= 0:
+            return idle is not None and idle()
+        deadline = self._advance( seconds, timeline )
+        if idle is None:
+            remaining = deadline - time.monotonic_ns()
+            if remaining > 0:
+                time.sleep( remaining / 1000000000 )
+            return False
+        while True:
+            if idle():
+                return True
+            remaining = deadline - time.monotonic_ns()
+            if remaining <= 0:
+                return False
+            time.sleep( min( remaining / 1000000000, self.IDLE_SLICE ) )
+
+    def type_reports( self, nchars, reports, start=0, end=None ):
+        '''
+        send reports made by `encode_string` straight to the keyboard device, spaced
+          by at least report_interval. The idle hook is called every 32 reports
+        :param int nchars: number of characters the reports type, for typing_stats, None
+            to leave typing_stats to the caller
+        :param bytes reports: (modifier bits, keycode) pairs
+        @return bool True if the idle hook asked for the script to stop
+        '''
+        if end is None:
+            end = len( reports )
+        report = self._report
+        send = self.kbd._keyboard_device.send_report
+        idle = self.idle
+        interval = int( self.report_interval * 1000000000 )
+        began = time.monotonic_ns()
+        deadline = began
+        for i in range( start, end, 2 ):
+            if interval:
+                now = time.monotonic_ns()
+                if now < deadline:
+                    time.sleep( ( deadline - now ) / 1000000000 )
+                deadline += interval
+            report[0] = reports[i]
+            report[2] = reports[i+1]
+            send( report )
+            if idle is not None and ( i - start ) % 64 == 62 and idle():
+                # release whatever is held before stopping
+                report[0] = 0
+                report[2] = 0
+                send( report )
+                return True
+        if nchars is not None:
+            self.typing_stats = ( nchars, time.monotonic_ns() - began )
+        return False
+
+class AsyncDuckyEngine( DuckyEngine ):
+    '''
+    DuckyEngine for the asyncio runtime. Running a script returns a coroutine, and
+      DELAY, DEFAULT_DELAY and the pauses between lines are awaited, so the keypad keeps
+      being scanned and other macros keep running while a script waits
+    '''
+
+    async def run_compiled( self, script ):
+        '''
+        run a CompiledScript, awaiting the default delay after every op
+        '''
+        await self.run_ops( script.ops )
+
+    async def run_ops( self, ops, variables=None ):
+        '''
+        run an iterable of (op, arg) pairs, awaiting the default delay after every op
+          other than control flow
+        '''
+        if variables is None:
+            variables = []
+        run_op = self.run_op_async
+        timeline = self._start_timeline()
+        try:
+            for op, arg in ops:
+                await run_op( op, arg, variables, timeline )
+                if op < OP_SET:
+                    await self.sleep( timeline )
+        except BaseException:
+            # stopped part way, cancelled by the REPLACE policy for example, so release
+            # whatever the last report left held
+            self.kbd.release_all()
+            raise
+        finally:
+            self._end_timeline( timeline )
+
+    async def run_block( self, ops, variables, timeline=None ):
+        '''
+        run the ops of an OP_BLOCK, following its jumps. Every time a loop goes round
+          the other tasks get a turn
+        '''
+        run_op = self.run_op_async
+        pc = 0
+        end = len( ops )
+        while pc < end:
+            op, arg = ops[pc]
+            pc += 1
+            if op == OP_BRANCH:
+                if not self.evaluate( arg[0], variables ):
+                    pc = arg[1]
+            elif op == OP_JUMP:
+                if arg < pc:
+                    await asyncio.sleep( 0 )
+                pc = arg
             else:
-                self.parse_line( line )
-                previous = line
-            self.sleep()
+                await run_op( op, arg, variables, timeline )
+                if op < OP_SET:
+                    await self.sleep( timeline )
+
+    async def run_file( self, filename ):
+        '''
+        run a script file straight from flash with `stream_file`
+        '''
+        try:
+            await self.run_ops( self.stream_file( filename ) )
+        except OSError:
+            print( "Unable to open file ", filename )
+
+    async def run_multiline_string( self, in_str ):
+        await self.run_compiled( self.compile( in_str ) )
+
+    async def run_op_async( self, op, arg, variables=None, timeline=None ):
+        '''
+        run a single compiled op, awaiting instead of sleeping on DELAY
+        '''
+        if op == OP_BLOCK:
+            await self.run_block( arg, variables, timeline )
+        elif op == OP_REPEAT:
+            count, ( op, arg ) = arg
+            for i in range( count ):
+                # repeat the last command
+                await self.run_op_async( op, arg, variables, timeline )
+                if op < OP_SET:
+                    await self.sleep( timeline )
+        elif op == OP_DELAY:
+            await self.wait_async( arg / 1000, timeline )
+        elif op == OP_TYPE:
+            # long strings go out in slices so the scan task gets a turn
+            nchars, reports = arg
+            sending = 0
+            for start in range( 0, len( reports ), 64 ):
+                began = time.monotonic_ns()
+                self.type_reports( None, reports, start, min( start + 64, len( reports ) ) )
+                sending += time.monotonic_ns() - began
+                await asyncio.sleep( 0 )
+            # the whole string, not counting the turns other tasks took in between
+            self.typing_stats = ( nchars, sending )
+        else:
+            self.run_op( op, arg, variables, timeline )
 
-    def sleep( self ):
-        time.sleep( float(self.default_delay) / 1000 )
+    async def sleep( self, timeline=None ):
+        # always yields, so the scan task gets a turn between lines
+        delay = self.default_delay if timeline is None else timeline[5]
+        await self.wait_async( float(delay) / 1000, timeline )
 
+    async def wait_async( self, seconds, timeline=None ):
+        '''
+        await the running script's timeline moving on by seconds, like `wait`. Macros
+          running at the same time each await their own timeline
+        '''
+        remaining = 0
+        if seconds > 0:
+            remaining = self._advance( seconds, timeline ) - time.monotonic_ns()
+        await asyncio.sleep( max( remaining, 0 ) / 1000000000 )
@@ -6,87 +6,697 @@ import adafruit_dotstar
 import board
 import busio
 import digitalio as dio
+import os
+import struct
+import time
 from adafruit_bus_device.i2c_device import I2CDevice
 
 # --------------
 # CONTENTS
 # 1. Classes
-#   a. LED
-#   b. Key (uses LED)
-#   c. Pad (uses Key)
-#   d. MacroPad (uses Pad)
+#   a. Scanner
+#   b. KeyEvent
+#   c. EventQueue (uses KeyEvent)
+#   d. DispatchQueue
+#   e. Framebuffer
+#   f. Animation
+#   g. Animator (uses Animation, Framebuffer)
+#   h. LED (uses Framebuffer)
+#   i. Key (uses LED, Scanner)
+#   j. ScanScheduler
+#   k. Pad (uses Key, Scanner, EventQueue, Framebuffer, Animator, ScanScheduler)
+#   l. Layer
+#   m. MacroPad (uses Pad, Layer, DispatchQueue)
 # 2. Functions
 # --------------
 
+# key event kinds
+PRESS = 0
+RELEASE = 1
+HOLD = 2
+
+# dispatch queue policies, for a callback whose key is already queued or running
+FIFO = 0
+DROP_DUPLICATES = 1
+REPLACE = 2
+
+# event names used in binding configs
+EVENT_NAMES = { "press": PRESS, "release": RELEASE, "hold": HOLD }
+
+# compiled binding configs, written next to the config file: a header of the magic and
+# the config's size and mtime, the length prefixed bindings as JSON, then each compiled
+# script as length prefixed precompiled records
+CONFIG_SUFFIX = ".pdc"
+CONFIG_MAGIC = b"PDC1"
+
 # 1. Classes ---
 
 # 1a.
+class Scanner:
+    '''
+    Scanner object. Reads the keypad's i2c expanders, one transaction each in a single
+      pass holding the bus, and keeps the result as an integer bitmask, where bit n is
+      set when key n is pressed. Every state query made within the same tick answers
+      from that one snapshot. Given the expanders' interrupt line, a scan only reads
+      them when the line signals a change, plus a safety read every safety_poll
+      seconds; if a safety read finds a change the line never signalled, the line
+      isn't wired and the scanner goes back to reading on every scan
+    '''
+    def __init__( self, expander, nkeys=16, tick=0.005, stats=None, interrupt=None, safety_poll=0.1, key_maps=None ):
+        '''
+        :param expander: the keypad's i2c expander as an I2CDevice, or a list of them on
+            the same bus
+        :param int nkeys: number of keys on the pad
+        :param float tick: seconds a snapshot stays valid before a query reads the expander again
+        :param Stats stats: pad_stats.Stats to record scans in, None to not record
+        :param DigitalInOut interrupt: input wired to the expanders' active low INT lines,
+            which are open drain and can share it, None to read them on every scan
+        :param float safety_poll: seconds after which the expanders are read even though
+            the interrupt line hasn't signalled
+        :param list key_maps: for each expander, the key num wired to each of its 16
+            inputs, None for an unused input. By default expander n's inputs are keys
+            16n to 16n+15
+        '''
+        if not isinstance( expander, ( list, tuple ) ):
+            expander = [ expander ]
+        if key_maps is None:
+            key_maps = [ None ] * len( expander )
+        if len( key_maps ) != len( expander ):
+            raise Exception( f"Got {len(key_maps)} key maps for {len(expander)} expanders" )
+
+        # per expander: address, read buffer, and the shift of its inputs into the key
+        # mask or, with a key map, a dict of input bit to key bit
+        self._i2c = expander[0].i2c
+        self._reads = []
+        wired = 0
+        for n, device in enumerate( expander ):
+            key_map = key_maps[n]
+            if key_map is None:
+                # inputs past nkeys are left unused
+                key_map = range( 16 * n, min( 16 * n + 16, nkeys ) )
+                bits = None
+            else:
+                bits = {}
+            for bit, key_num in enumerate( key_map ):
+                if key_num is None:
+                    continue
+                if not 0 <= key_num < nkeys:
+                    raise Exception( f"Key {key_num} of expander 0x{device.device_address:02x} not in current key range {range(nkeys)}" )
+                if wired >> key_num & 1:
+                    raise Exception( f"Key {key_num} is wired to more than one expander input" )
+                wired |= 1 << key_num
+                if bits is not None:
+                    bits[ 1 << bit ] = 1 << key_num
+            self._reads.append( ( device.device_address, bytearray(2), 16 * n, bits ) )
+
+        self._stats = stats
+        self._nkeys = nkeys
+        self._key_mask = ( 1 << nkeys ) - 1
+        self._tick_ns = int( tick * 1000000000 )
+        self._interrupt = interrupt
+        self._safety_ns = int( safety_poll * 1000000000 )
+        self._read_at = None
+
+        # the input port register, read buffers are preallocated so a scan doesn't allocate
+        self._register = bytes([0x0])
+
+        # snapshot
+        self._mask = 0
+        self._scanned_at = None
+
+    @property
+    def mask( self ):
+        '''
+        bitmask of the pressed keys, read from the expander if the snapshot is stale
+        '''
+        if self._scanned_at is None or time.monotonic_ns() - self._scanned_at >= self._tick_ns:
+            self.scan()
+        return self._mask
+
+    @property
+    def interrupt_driven( self ):
+        '''
+        True while scans are gated by the expander's interrupt line
+        '''
+        return self._interrupt is not None
+
+    @property
+    def nkeys( self ):
+        return self._nkeys
+
+    def is_pressed( self, key_num ):
+        '''
+        check a single key against the snapshot
+        '''
+        return bool( self.mask >> key_num & 1 )
+
+    @property
+    def nexpanders( self ):
+        '''
+        number of expanders read in each scan
+        '''
+        return len( self._reads )
+
+    def scan( self ):
+        '''
+        read every expander once and cache the state of every key. The expanders pull
+          pressed keys low, so their inverted port values make the pressed key bitmask.
+          With an interrupt line that hasn't signalled, the cached state is kept and
+          the bus stays silent
+        @return int
+        '''
+        started = time.monotonic_ns()
+        interrupt = self._interrupt
+        safety = False
+        if interrupt is not None and self._read_at is not None and interrupt.value:
+            if started - self._read_at < self._safety_ns:
+                self._scanned_at = started
+                return self._mask
+            safety = True
+
+        # one pass over the expanders, locking the bus once
+        i2c = self._i2c
+        register = self._register
+        while not i2c.try_lock():
+            pass
+        try:
+            for address, result, shift, bits in self._reads:
+                i2c.writeto_then_readfrom( address, register, result )
+        finally:
+            i2c.unlock()
+
+        mask = 0
+        for address, result, shift, bits in self._reads:
+            port = ~( result[0] | result[1] << 8 ) & 0xFFFF
+            if bits is None:
+                mask |= port << shift
+                continue
+            while port:
+                low = port & -port
+                mask |= bits.get( low, 0 )
+                port ^= low
+        mask &= self._key_mask
+        if safety and mask != self._mask:
+            # the keys changed without the line going low, so it isn't wired
+            self._interrupt = None
+            if self._stats is not None:
+                self._stats.count( "scan.interrupt_fallback" )
+        self._mask = mask
+        self._scanned_at = self._read_at = time.monotonic_ns()
+        if self._stats is not None:
+            self._stats.count( "i2c.transactions", len( self._reads ) )
+            self._stats.record( "scan", self._scanned_at - started )
+        return mask
+
+
+# 1b.
+class KeyEvent:
+    '''
+    A debounced change of a key, timestamped with the monotonic_ns of the scan that saw it
+    '''
+    __slots__ = ( "key", "kind", "time" )
+
+    def __init__( self, key, kind, time ):
+        '''
+        :param int key: the key number
+        :param int kind: PRESS, RELEASE or HOLD
+        :param int time: monotonic_ns of the scan that produced the event
+        '''
+        self.key = key
+        self.kind = kind
+        self.time = time
+
+    def __repr__( self ):
+        return f"KeyEvent({self.key}, {('PRESS','RELEASE','HOLD')[self.kind]}, {self.time})"
+
+
+# 1c.
+class EventQueue:
+    '''
+    Bounded ring buffer of key events. When full, the oldest event is dropped to make
+      room and counted in `overflows`
+    '''
+    def __init__( self, size=32 ):
+        '''
+        :param int size: maximum number of events kept
+        '''
+        self._items = [None] * size
+        self._size = size
+        self._head = 0
+        self._len = 0
+        self.overflows = 0
+
+    def __len__( self ):
+        return self._len
+
+    def clear( self ):
+        '''
+        drop every queued event
+        '''
+        for i in range( self._size ):
+            self._items[i] = None
+        self._head = 0
+        self._len = 0
+
+    def pop( self ):
+        '''
+        remove and return the oldest event, None if the queue is empty
+        @return KeyEvent
+        '''
+        if not self._len:
+            return None
+        event = self._items[ self._head ]
+        self._items[ self._head ] = None
+        self._head = ( self._head + 1 ) % self._size
+        self._len -= 1
+        return event
+
+    def push( self, event ):
+        '''
+        add an event, dropping the oldest one if the queue is full
+        '''
+        if self._len == self._size:
+            self._head = ( self._head + 1 ) % self._size
+            self._len -= 1
+            self.overflows += 1
+        self._items[ ( self._head + self._len ) % self._size ] = event
+        self._len += 1
+
+
+# 1d.
+class DispatchQueue:
+    '''
+    Bounded queue of callbacks waiting to run, as (name, callback, kwargs) jobs. The
+      policy decides what happens to a job whose name is already queued: FIFO queues it
+      behind the other, DROP_DUPLICATES drops it and REPLACE puts it in the other's
+      place. When full, the oldest job is dropped to make room. Drops are counted, and
+      `high_water` keeps the longest the queue has been, for sizing it
+    '''
+    def __init__( self, size=16, policy=FIFO ):
+        '''
+        :param int size: maximum number of jobs kept
+        :param int policy: FIFO, DROP_DUPLICATES or REPLACE
+        '''
+        self._jobs = []
+        self._size = size
+        self.policy = policy
+        self.overflows = 0
+        self.duplicates = 0
+        self.replaced = 0
+        self.high_water = 0
+
+    def __len__( self ):
+        return len( self._jobs )
+
+    def __contains__( self, name ):
+        for job in self._jobs:
+            if job[0] == name:
+                return True
+        return False
+
+    def clear( self ):
+        '''
+        drop every queued job
+        '''
+        self._jobs = []
+
+    def pop( self ):
+        '''
+        remove and return the oldest job, None if the queue is empty
+        @return tuple
+        '''
+        if not self._jobs:
+            return None
+        return self._jobs.pop( 0 )
+
+    def push( self, name, callback, kwargs ):
+        '''
+        add a job, following the policy
+        @return bool True if the job was queued
+        '''
+        jobs = self._jobs
+        if self.policy != FIFO:
+            for i in range( len( jobs ) ):
+                if jobs[i][0] == name:
+                    if self.policy == DROP_DUPLICATES:
+                        self.duplicates += 1
+                        return False
+                    jobs[i] = ( name, callback, kwargs )
+                    self.replaced += 1
+                    return True
+        if len( jobs ) == self._size:
+            jobs.pop( 0 )
+            self.overflows += 1
+        jobs.append( ( name, callback, kwargs ) )
+        if len( jobs ) > self.high_water:
+            self.high_water = len( jobs )
+        return True
+
+
+# 1e.
+class Framebuffer:
+    '''
+    Framebuffer object. Keeps a copy of every pixel's color in front of the DotStar
+      strip, which must be created with auto_write=False. Setting a pixel to the color
+      it already has is skipped, and changed pixels reach the strip in one transfer on
+      `show`. With auto_write on, every change is shown right away instead.
+      It also holds the state of the LED views over it: each pixel's last non black
+      color and a mask of the lit ones
+    '''
+    def __init__( self, pixel_array, auto_write=False, stats=None ):
+        '''
+        :param DotStar pixel_array: adafruit dotstar pixel array, with auto_write off
+        :param bool auto_write: show every change immediately
+        :param Stats stats: pad_stats.Stats to record transfers in, None to not record
+        '''
+        self._pixel_array = pixel_array
+        self._stats = stats
+        self._colors = bytearray( 3 * len( pixel_array ) )
+        self.saved = bytearray( 3 * len( pixel_array ) )
+        self.lit = 0
+        self.auto_write = auto_write
+        self.dirty = False
+
+    def __len__( self ):
+        return len( self._pixel_array )
+
+    @property
+    def colors( self ):
+        '''
+        the buffered colors, 3 bytes per pixel. Read only, use `set` or `load` to change
+        '''
+        return self._colors
+
+    def get( self, number ):
+        '''
+        the buffered (r, g, b) of a pixel
+        '''
+        i = 3 * number
+        colors = self._colors
+        return ( colors[i], colors[i+1], colors[i+2] )
+
+    def set( self, number, r, g, b ):
+        '''
+        set a pixel, doing nothing if it already has that color
+        '''
+        i = 3 * number
+        colors = self._colors
+        if colors[i] == r and colors[i+1] == g and colors[i+2] == b:
+            return
+        colors[i] = r
+        colors[i+1] = g
+        colors[i+2] = b
+        self._pixel_array[ number ] = (r,g,b)
+        self.dirty = True
+        if self.auto_write:
+            self.show()
+
+    def load( self, colors ):
+        '''
+        replace the whole frame with precomputed colors, 3 bytes per pixel, as the LEDs'
+          colors. Only the pixels that differ are written
+        '''
+        current = self._colors
+        if current == colors:
+            return
+        pixel_array = self._pixel_array
+        saved = self.saved
+        for number in range( len( pixel_array ) ):
+            i = 3 * number
+            if current[i] != colors[i] or current[i+1] != colors[i+1] or current[i+2] != colors[i+2]:
+                pixel_array[ number ] = ( colors[i], colors[i+1], colors[i+2] )
+                if colors[i] or colors[i+1] or colors[i+2]:
+                    saved[i:i+3] = colors[i:i+3]
+        current[:] = colors
+        self.dirty = True
+        if self.auto_write:
+            self.show()
+
+    def show( self ):
+        '''
+        push the frame to the strip if anything changed since the last push
+        '''
+        if self.dirty:
+            if self._stats is None:
+                self._pixel_array.show()
+            else:
+                started = time.monotonic_ns()
+                self._pixel_array.show()
+                self._stats.record( "led.show", time.monotonic_ns() - started )
+                # what the strip actually sent, less than a full frame for a partial update
+                sent = self._pixel_array.last_transmit_bytes
+                if sent:
+                    self._stats.count( "spi.transfers" )
+                    self._stats.count( "spi.bytes", sent )
+            self.dirty = False
+
+
+# 1f.
+class Animation:
+    '''
+    Animation object. A per-key led effect whose frames are rendered once, up front, into
+      a bytearray of r,g,b triples with gamma correction and brightness already applied
+      through a lookup table, so playing it is just copying three bytes per frame
+    '''
+    def __init__( self, frames, fps=30, loop=False, gamma=2.2, brightness=1.0 ):
+        '''
+        :param list frames: list of [r,g,b] colors, one per frame
+        :param int fps: frames per second the animation is played at
+        :param bool loop: start over after the last frame instead of ending
+        :param float gamma: gamma correction applied to every channel
+        :param float brightness: brightness from 0 to 1 applied to every channel
+        '''
+        table = gamma_table( gamma, brightness )
+        self.frames = bytearray( 3 * len( frames ) )
+        i = 0
+        for rgb in frames:
+            self.frames[i] = table[ rgb[0] ]
+            self.frames[i+1] = table[ rgb[1] ]
+            self.frames[i+2] = table[ rgb[2] ]
+            i += 3
+        self.nframes = len( frames )
+        self.fps = fps
+        self.loop = loop
+
+    def __len__( self ):
+        return self.nframes
+
+    @classmethod
+    def breathe( cls, color, period=2000, fps=30, **kwargs ):
+        '''
+        looping animation that fades a color in and out
+
+        :arg list color: [r,g,b] at the top of the breath
+        :arg int period: ms per breath
+        '''
+        import math
+
+        n = max( 2, period * fps // 1000 )
+        frames = []
+        for i in range( n ):
+            level = ( 1 - math.cos( 2 * math.pi * i / n ) ) / 2
+            frames.append( [ int( c * level ) for c in color ] )
+        return cls( frames, fps=fps, loop=True, **kwargs )
+
+    @classmethod
+    def fade( cls, start, end, duration=500, fps=30, **kwargs ):
+        '''
+        animation that fades linearly from one color to another
+
+        :arg list start: [r,g,b] of the first frame
+        :arg list end: [r,g,b] of the last frame
+        :arg int duration: ms the fade takes
+        '''
+        n = max( 2, duration * fps // 1000 )
+        frames = []
+        for i in range( n ):
+            frames.append( [ a + ( b - a ) * i // ( n - 1 ) for a, b in zip( start, end ) ] )
+        return cls( frames, fps=fps, **kwargs )
+
+    @classmethod
+    def flash( cls, color, duration=200, fps=30, **kwargs ):
+        '''
+        animation that lights a color and fades it out, for key presses
+
+        :arg list color: [r,g,b] of the flash
+        :arg int duration: ms the flash takes to fade
+        '''
+        return cls.fade( color, [0,0,0], duration=duration, fps=fps, **kwargs )
+
+
+# 1g.
+class Animator:
+    '''
+    Animator object. Plays animations on keys by writing their frames into the pad's
+      framebuffer. `tick` is called once per scan and returns straight away until the
+      next frame is due, so animations never hold up scanning, and the whole strip
+      changes at most `fps` times a second. A late tick skips frames rather than
+      slowing the animation down
+    '''
+    def __init__( self, framebuffer, fps=30 ):
+        '''
+        :param Framebuffer framebuffer: the pad's led framebuffer
+        :param int fps: maximum frames per second pushed to the strip
+        '''
+        self._framebuffer = framebuffer
+        self._period = 1000000000 // fps
+        self._next_frame = 0
+        self._playing = {}
+
+    @property
+    def period( self ):
+        '''
+        ns between frames
+        '''
+        return self._period
+
+    @property
+    def playing( self ):
+        '''
+        key numbers with an animation playing
+        '''
+        return list( self._playing )
+
+    def play( self, key_num, animation ):
+        '''
+        start an animation on a key, replacing the one playing there. The key goes back
+          to its current color when the animation ends or is stopped
+        '''
+        restore = self._playing[ key_num ][2] if key_num in self._playing else self._framebuffer.get( key_num )
+        self._playing[ key_num ] = ( animation, time.monotonic_ns(), restore )
+        self._next_frame = 0
+
+    def stop( self, key_num ):
+        '''
+        stop the animation on a key and restore its color
+        '''
+        if key_num in self._playing:
+            animation, start, restore = self._playing.pop( key_num )
+            self._framebuffer.set( key_num, restore[0], restore[1], restore[2] )
+
+    def stop_all( self ):
+        '''
+        stop every animation and restore the keys' colors
+        '''
+        for key_num in list( self._playing ):
+            self.stop( key_num )
+
+    def tick( self, now=None ):
+        '''
+        write the current frame of every playing animation into the framebuffer, if a
+          frame is due
+        @return bool True if frames were written
+        '''
+        if not self._playing:
+            return False
+        if now is None:
+            now = time.monotonic_ns()
+        if now < self._next_frame:
+            return False
+        self._next_frame = now + self._period
+
+        # write every key, then show once
+        framebuffer = self._framebuffer
+        auto_write = framebuffer.auto_write
+        framebuffer.auto_write = False
+        for key_num in list( self._playing ):
+            animation, start, restore = self._playing[ key_num ]
+            index = ( now - start ) * animation.fps // 1000000000
+            if index >= animation.nframes:
+                if not animation.loop:
+                    self.stop( key_num )
+                    continue
+                index %= animation.nframes
+            i = 3 * index
+            frames = animation.frames
+            framebuffer.set( key_num, frames[i], frames[i+1], frames[i+2] )
+        framebuffer.auto_write = auto_write
+        if auto_write:
+            framebuffer.show()
+        return True
+
+
+# 1h.
 class LED:
     '''
-    LED object
+    LED object. A view of one pixel of the framebuffer; the led's colors and lit state
+      live in the framebuffer's shared buffers, not on the object
     '''
-    def __init__( self, number, pixel_array ):
+    __slots__ = ( "_number", "_framebuffer" )
+
+    def __init__( self, number, framebuffer ):
         '''
         :param int array_number: number in the dotstar array that corresponds to the key's led
-        :param DotStar pixel_array: adafruit dotstar pixel array
+        :param Framebuffer framebuffer: the pad's led framebuffer
         '''
         self._number = number
-        self._pixel_array = pixel_array
-        self._value = None
-        self._lit = False
+        self._framebuffer = framebuffer
+
+    @property
+    def is_lit( self ):
+        '''
+        True if the led was last turned on with `on` rather than off with `off`
+        '''
+        return bool( self._framebuffer.lit >> self._number & 1 )
 
     def set( self, r, g, b ):
         '''
         set the led to a given rgb value
         '''
         # save the value if not all 0s
-        if r and g and b:
-            self._value = [r,g,b]
+        if r or g or b:
+            i = 3 * self._number
+            saved = self._framebuffer.saved
+            saved[i] = r
+            saved[i+1] = g
+            saved[i+2] = b
 
         # set the led
-        self._pixel_array[ self._number ] = (r,g,b)
+        self._framebuffer.set( self._number, r, g, b )
 
     def on( self ):
         '''
         turn the led on to the last value, (255,255,255 if no last value)
         '''
-        if self._value:
-            value = [255,255,255]
+        i = 3 * self._number
+        saved = self._framebuffer.saved
+        if saved[i] or saved[i+1] or saved[i+2]:
+            self.set( saved[i], saved[i+1], saved[i+2] )
         else:
-            value = self._value
-
-        self.set( value[0], value[1], value[2] )
-        self._lit = True
+            self.set( 255, 255, 255 )
+        self._framebuffer.lit |= 1 << self._number
 
     def off( self ):
         '''
         turn the led off
         '''
         self.set( 0, 0, 0 )
-        self._lit = False
+        self._framebuffer.lit &= ~( 1 << self._number )
 
 
-# 1b. Key
+# 1i. Key
 class Key:
+    __slots__ = ( "_number", "_scanner", "led" )
 
-    def __init__( self, number, pixel_array, expander, rgb=[10,10,10] ):
+    def __init__( self, number, framebuffer, scanner, rgb=( 10, 10, 10 ) ):
         '''
-        Represents a key on the keypad. Has an LED
+        Represents a key on the keypad. Has an LED. The key's state comes from the
+          scanner's mask and its color from the framebuffer, so a key is only a view
         :param int number: the key number
-        :param DotStar pixel_array: adafruit dotstar pixel array
-        :param list rgb: 3 value list of rgb values for the key's LED
+        :param Framebuffer framebuffer: the pad's led framebuffer
+        :param Scanner scanner: the pad's shared key scanner
+        :param list rgb: 3 value list of rgb values for the key's LED, None to leave it
         '''
         # set given vars
         self._number = number
-        self._pixel_array = pixel_array
-        self._rgb = rgb
-        self._expander = expander
+        self._scanner = scanner
 
         # set other vars
-        self.led = LED( number, pixel_array )
+        self.led = LED( number, framebuffer )
 
         # turn on the led
-        self.led.set( rgb[0], rgb[1], rgb[2] )
+        if rgb is not None:
+            self.led.set( rgb[0], rgb[1], rgb[2] )
 
     @property
     def is_pressed( self ):
@@ -94,105 +704,301 @@ class Key:
         return true if key is pressed else return false
         IMPORTANT: KEYPAD NUMBERS START AT 0
         '''
-        return bool( self.keypad_state[ self._number ] )
+        return self._scanner.is_pressed( self._number )
 
     @property
     def keypad_state( self ):
         '''
-        uses the expander and finds the state of the keypad and its presses. Returns
+        uses the scanner snapshot to find the state of the keypad and its presses. Returns
           a list of all key states (0 if not pressed, 1 if pressed).
           for example, if the 2nd button is pressed out of 16 buttons, then the return
           value would be
 
             [0,0,1,0,0,0,0,0,0,0,0,0,0,0,0,0]
         '''
+        mask = self._scanner.mask
+        return [ mask >> i & 1 for i in range( self._scanner.nkeys ) ]
 
-        # get data from i2c expander
-        with self._expander as expander:
-            expander.write( bytes([0x0]) )
-            result = bytearray(2)
-            expander.readinto( result )
-
-        # get the inverted state
-        inverted_state = result[0] | result[1] << 8
-        inverted_state = "{0:b}".format( inverted_state )
-
-        # invert the inverted state, giving the desired state format
-        state = []
-        for val in inverted_state:
-            state_value = '0' if val=='1' else '1'
-            state.insert(0, state_value)
-
-        # return the state
-        return state
+    @property
+    def rgb( self ):
+        '''
+        the (r, g, b) the key's led shows
+        '''
+        return self.led._framebuffer.get( self._number )
 
     @property
     def state( self ):
-        return self.keypad_state[self._number]
+        return self._scanner.mask >> self._number & 1
 
     def __int__( self ):
         return self._number
 
 
-# 1c.
+# 1j.
+class ScanScheduler:
+    '''
+    ScanScheduler object. Decides how long to wait before the next scan: the active
+      period while keys are down and for `linger` ms after the last one is released,
+      then doubling every scan until it reaches the idle period. Also measures the
+      effective scan rate
+    '''
+    def __init__( self, active_rate=500, idle_rate=50, linger=1000 ):
+        '''
+        :param int active_rate: scans per second while keys are in use, the latency target
+            for presses made while typing
+        :param int idle_rate: scans per second while idle, the idle power target. A first
+            press waits at most 1/idle_rate seconds for its scan
+        :param int linger: ms to stay at the active rate after the last key is released
+        '''
+        self._active = 1000000000 // active_rate
+        self._idle = 1000000000 // idle_rate
+        self._linger = linger * 1000000
+        self._interval = self._active
+        self._active_at = time.monotonic_ns()
+
+        # effective rate, measured over windows of at least a second
+        self._scans = 0
+        self._window_start = self._active_at
+        self.rate = 0
+
+    @property
+    def interval( self ):
+        '''
+        ns to wait between the last scan and the next
+        '''
+        return self._interval
+
+    @property
+    def latency( self ):
+        '''
+        longest ms a press can wait for a scan at the current interval
+        '''
+        return self._interval / 1000000
+
+    def wake( self, now=None ):
+        '''
+        go back to the active rate, e.g. when something other than a key needs attention
+        '''
+        self._active_at = time.monotonic_ns() if now is None else now
+        self._interval = self._active
+
+    def note( self, mask, now ):
+        '''
+        account for a scan and adjust the interval to the keys it found
+        @return int ns until the next scan
+        '''
+        self._scans += 1
+        if now - self._window_start >= 1000000000:
+            self.rate = self._scans * 1000000000 / ( now - self._window_start )
+            self._scans = 0
+            self._window_start = now
+
+        if mask:
+            self._active_at = now
+            self._interval = self._active
+        elif self._interval < self._idle and now - self._active_at >= self._linger:
+            self._interval = min( self._idle, self._interval * 2 )
+        return self._interval
+
+
+# 1k.
 class Pad:
     '''
-    pico keypad instance
+    pico keypad instance. Startup is timed stage by stage into `boot_times`, ns per
+      stage, and "first_event" is set to the monotonic time (ns since power on) of the
+      first key event, to measure time to first key press
     '''
+    # color every key starts with
+    DEFAULT_COLOR = ( 10, 10, 10 )
 
-    def __init__( self, nkeys=16 ):
+    def __init__( self, nkeys=None, debounce=5, hold=500, queue_size=32, framebuffer=False, fps=30, stats=None, interrupt=None,
+                  i2c_frequency=400000, active_rate=500, idle_rate=50, linger=1000, expanders=( 0x20, ), key_maps=None ):
         '''
-        :param int nkeys: number of keys on the pad
+        :param int nkeys: number of keys, and leds on the dotstar chain, 16 per expander
+            or the keys in key_maps if not given
+        :param int debounce: ms after a key changes during which it can't change again
+        :param int hold: ms a key has to stay pressed before a HOLD event is sent
+        :param int queue_size: number of events kept waiting before the oldest are dropped
+        :param bool framebuffer: hold led changes until the end of the tick (`update`) or an
+            explicit `show`, instead of pushing each one to the strip as it's made
+        :param int fps: maximum frames per second for led animations
+        :param Stats stats: pad_stats.Stats to record bus traffic and timings in, None (the
+            default) turns instrumentation off
+        :param Pin interrupt: board pin wired to the expanders' INT lines, to only read the
+            expanders when a key changes. None (the default) reads them on every scan
+        :param int i2c_frequency: i2c bus clock in Hz, the TCA9555 takes up to 400kHz
+        :param int active_rate: scans per second while keys are in use, see ScanScheduler
+        :param int idle_rate: scans per second while idle, see ScanScheduler
+        :param int linger: ms to keep the active rate after the last release
+        :param list expanders: i2c addresses of the key expanders, all read in every scan
+        :param list key_maps: for each expander, the key num wired to each of its 16
+            inputs, None for an unused input. By default expander n's inputs are keys
+            16n to 16n+15
         '''
+        if nkeys is None:
+            if key_maps is None:
+                nkeys = 16 * len( expanders )
+            else:
+                wired = []
+                for n, key_map in enumerate( key_maps ):
+                    if key_map is None:
+                        key_map = range( 16 * n, 16 * n + 16 )
+                    wired.extend( key_num for key_num in key_map if key_num is not None )
+                if not wired:
+                    raise Exception( "The key maps don't wire any keys, give nkeys or map some inputs" )
+                nkeys = 1 + max( wired )
+        self._stats = stats
+        self.boot_times = {}
+        started = time.monotonic_ns()
 
         # set up the board led
         self._board_led = dio.DigitalInOut( board.GP17 )
         self._board_led.direction = dio.Direction.OUTPUT
         self._board_led.value = 0
 
-        # create the i2c device
-        self._i2c = busio.I2C( board.GP5, board.GP4 )
-        self._expander = I2CDevice( self._i2c, 0x20 )
+        # create the i2c devices
+        self._i2c = busio.I2C( board.GP5, board.GP4, frequency=i2c_frequency )
+        self._expanders = [ I2CDevice( self._i2c, address ) for address in expanders ]
+        interrupt_line = None
+        if interrupt is not None:
+            interrupt_line = dio.DigitalInOut( interrupt )
+            interrupt_line.switch_to_input( pull=dio.Pull.UP )
+        self._scanner = Scanner( self._expanders, nkeys, stats=stats, interrupt=interrupt_line, key_maps=key_maps )
+        started = self._boot_stage( "i2c", started )
 
-        # create the dotstar pixel array
-        self._pixel_array = adafruit_dotstar.DotStar( board.GP18, board.GP19, nkeys, brightness=0.1, auto_write=True )
+        # create the dotstar pixel array, writes go through the framebuffer
+        self._pixel_array = adafruit_dotstar.DotStar( board.GP18, board.GP19, nkeys, brightness=0.1, auto_write=False, partial_updates=True )
+        self._framebuffer = Framebuffer( self._pixel_array, stats=stats )
+        started = self._boot_stage( "leds", started )
 
-        # create the keys
+        # create the keys, then paint them all from one precomputed frame
         self._nkeys = nkeys
         self._keys = []
         for i in range( nkeys ):
-            k = Key( i, self._pixel_array, self._expander )
+            k = Key( i, self._framebuffer, self._scanner, rgb=None )
             self._keys.append( k )
+        self._framebuffer.load( bytes( self.DEFAULT_COLOR ) * nkeys )
+        self._framebuffer.show()
+        self._framebuffer.auto_write = not framebuffer
+        self._animator = Animator( self._framebuffer, fps )
+        started = self._boot_stage( "keys", started )
+        self._booting = True
+
+        # scan rate
+        self._scheduler = ScanScheduler( active_rate, idle_rate, linger )
+        self._updated_at = time.monotonic_ns()
+
+        # debounced event state
+        self._events = EventQueue( queue_size )
+        self._stable = 0
+        self._held = 0
+        self._changed_at = [ time.monotonic_ns() - debounce * 1000000 ] * nkeys
+        self._debounce = [ debounce * 1000000 ] * nkeys
+        self._hold = hold * 1000000
 
     @property
     def is_pressed( self ):
-        state = self.state
-        state = [ int(i) for i in state ]
-        if any( state ):
+        if self._scanner.mask:
             self._board_led_on()
             return True
         else:
             self._board_led_off()
             return False
 
+    @property
+    def scan_interval( self ):
+        '''
+        seconds until the next scan is due, from the scan scheduler, and sooner while an
+          animation needs its next frame
+        '''
+        interval = self._scheduler.interval
+        if self._animator.playing and self._animator.period < interval:
+            interval = self._animator.period
+        wait = self._updated_at + interval - time.monotonic_ns()
+        return wait / 1000000000 if wait > 0 else 0
+
+    @property
+    def scan_rate( self ):
+        '''
+        effective scans per second, measured over the last second or so
+        '''
+        return self._scheduler.rate
+
+    @property
+    def scheduler( self ):
+        '''
+        the ScanScheduler that sets the scan rate
+        '''
+        return self._scheduler
+
+    @property
+    def animator( self ):
+        '''
+        the Animator that plays led animations on the keys
+        '''
+        return self._animator
+
+    @property
+    def stats( self ):
+        '''
+        the pad_stats.Stats instrumentation is recorded in, None when it's off
+        '''
+        return self._stats
+
+    @property
+    def events( self ):
+        '''
+        queue of debounced key events filled by `update`
+        '''
+        return self._events
+
     @property
     def keys( self ):
         return self._keys
 
+    @property
+    def mask( self ):
+        '''
+        bitmask of the pressed keys, bit n is set when key n is pressed
+        '''
+        return self._scanner.mask
+
     @property
     def pressed_keys( self ):
-        cur_state = self.state
-        return [i for i,n in enumerate(''.join(cur_state)) if n=="1"]
+        mask = self._scanner.mask
+        return [ i for i in range( self._nkeys ) if mask >> i & 1 ]
 
     @property
     def state( self ):
         return self._keys[0].keypad_state
 
+    def _boot_stage( self, name, started ):
+        '''
+        record how long a startup stage took
+        @return int now, when the next stage starts
+        '''
+        now = time.monotonic_ns()
+        self.boot_times[ name ] = now - started
+        if self._stats is not None:
+            self._stats.record( f"boot.{name}", now - started )
+        return now
+
     def _board_led_off( self ):
-        self._board_led = False
+        self._board_led.value = False
 
     def _board_led_on( self ):
-        self._board_led = True
+        self._board_led.value = True
+
+    def animate( self, key_num, animation ):
+        '''
+        play an animation on a key's led
+
+        :arg int key_num: key int val to animate
+        :arg Animation animation: the animation to play
+        '''
+        key_num = int( key_num )
+        self.check_key( key_num )
+        self._animator.play( key_num, animation )
 
     def check_key( self, key_num ):
         '''
@@ -201,6 +1007,101 @@ class Pad:
         if not self.valid_key( key_num ):
             raise Exception( f"Key {key_num} not in current key range {range(self._nkeys)}" )
 
+    def scan( self ):
+        '''
+        read the keypad once, starting a new tick. State queries made after this
+          answer from the same snapshot until it goes stale
+        @return int
+        '''
+        return self._scanner.scan()
+
+    def set_colors( self, colors ):
+        '''
+        set the rgb value of many keys at once, pushed to the strip in one transfer
+
+        :arg colors: a list of [r,g,b] starting at key 0, or a dict of key num to [r,g,b]
+        '''
+        items = colors.items() if hasattr( colors, "items" ) else enumerate( colors )
+        framebuffer = self._framebuffer
+        auto_write = framebuffer.auto_write
+        framebuffer.auto_write = False
+        try:
+            for key_num, rgb in items:
+                key_num = int( key_num )
+                self.check_key( key_num )
+                self.keys[ key_num ].led.set( rgb[0], rgb[1], rgb[2] )
+        finally:
+            framebuffer.auto_write = auto_write
+        if auto_write:
+            framebuffer.show()
+
+    def set_debounce( self, key_num, ms ):
+        '''
+        set the debounce time of a single key
+
+        :arg int key_num: key int val to configure
+        :arg int ms: ms after a change during which the key can't change again
+        '''
+        key_num = int( key_num )
+        self.check_key( key_num )
+        self._debounce[ key_num ] = ms * 1000000
+
+    def update( self ):
+        '''
+        scan the keypad once and queue press, release and hold events for every key
+          that changed since the last update. A key reports its first edge right away
+          and then ignores further changes for its debounce time, so bounces are
+          swallowed without delaying the press
+        @return int number of events queued
+        '''
+        if self._stats is not None:
+            began = time.monotonic_ns()
+        mask = self._scanner.scan()
+        now = time.monotonic_ns()
+        queued = 0
+
+        # edges
+        changed = mask ^ self._stable
+        if changed:
+            changed_at = self._changed_at
+            debounce = self._debounce
+            for key in mask_keys( changed ):
+                if now - changed_at[ key ] < debounce[ key ]:
+                    continue
+                changed_at[ key ] = now
+                bit = 1 << key
+                self._stable ^= bit
+                if mask & bit:
+                    self._events.push( KeyEvent( key, PRESS, now ) )
+                else:
+                    self._held &= ~bit
+                    self._events.push( KeyEvent( key, RELEASE, now ) )
+                queued += 1
+
+        # holds
+        waiting = self._stable & ~self._held
+        if waiting:
+            for key in mask_keys( waiting ):
+                if now - self._changed_at[ key ] >= self._hold:
+                    self._held |= 1 << key
+                    self._events.push( KeyEvent( key, HOLD, now ) )
+                    queued += 1
+
+        if queued and self._booting:
+            self._booting = False
+            self.boot_times[ "first_event" ] = now
+
+        # end of the tick, advance animations and push the led frame
+        self._animator.tick( now )
+        self._framebuffer.show()
+        self._scheduler.note( mask or queued, now )
+        self._updated_at = now
+
+        if self._stats is not None:
+            self._stats.record( "update", time.monotonic_ns() - began )
+
+        return queued
+
     def set_color( self, key_num, r, g, b ):
         '''
         set the rgb value of a key
@@ -209,6 +1110,24 @@ class Pad:
         self.check_key( key_num )
         self.keys[ key_num ].led.set( r, g, b )
 
+    def show( self ):
+        '''
+        push pending led changes to the strip, once, if there are any
+        '''
+        self._framebuffer.show()
+
+    def wait_for_scan( self ):
+        '''
+        sleep until the next scan is due, for main loops:
+
+            while True:
+                pad.dispatch()
+                pad.wait_for_scan()
+        '''
+        wait = self.scan_interval
+        if wait:
+            time.sleep( wait )
+
     def valid_key( self, key_num ):
         '''
         check to see if a given key number is valid
@@ -218,55 +1137,585 @@ class Pad:
         return int(key_num) in range( self._nkeys )
 
 
-# 1d.
+# 1l.
+class Layer:
+    '''
+    Layer object. One set of key bindings with its own dispatch tables and a
+      precomputed color frame for the keys, so a MacroPad can switch between macro sets
+      by swapping which layer it dispatches from and pushing the frame in one transfer.
+      Key bindings are kept in a flat table indexed by key num, so dispatching a press
+      is a single list index
+    '''
+    def __init__( self, name, nkeys=16, colors=None ):
+        '''
+        :param str name: the layer's name
+        :param int nkeys: number of keys on the pad
+        :param bytearray colors: initial color frame, 3 bytes per key, black if not given
+        '''
+        self.name = name
+        self.nkeys = nkeys
+        self.colors = bytearray( colors ) if colors else bytearray( 3 * nkeys )
+
+        # single key bindings, and the dispatch table of ( event, callback, kwargs,
+        # repeat ) entries by key num, None for unbound keys
+        self.bindings = {}
+        self.table = [ None ] * nkeys
+        self.bound_mask = 0
+        self.effects = {}
+
+        # chords, looked up by the bitmask of their keys
+        self.chords = {}
+        self.chord_keys = 0
+        self.chord_prefixes = set()
+
+        # keys that switch layer: key num to (layer name, momentary)
+        self.layer_keys = {}
+
+    def __repr__( self ):
+        return f"Layer({self.name!r})"
+
+    def check_key( self, key_num ):
+        '''
+        check to see if a key num can exist, raise error if not
+        '''
+        if int( key_num ) not in range( self.nkeys ):
+            raise Exception( f"Key {key_num} not in current key range {range(self.nkeys)}" )
+
+    def bind_chord( self, keys, callback, kwargs=None ):
+        '''
+        bind a callback to a combination of keys pressed together
+
+        :arg list keys: the key int vals of the chord, at least 2
+        :arg FunctionType callback: function to call when the chord is pressed
+        :arg dict kwargs: keyword arguments `dispatch` passes to the callback
+        '''
+        mask = 0
+        for key_num in keys:
+            key_num = int( key_num )
+            self.check_key( key_num )
+            mask |= 1 << key_num
+        if len( list( mask_keys( mask ) ) ) < 2:
+            raise Exception( f"A chord needs at least 2 different keys, got {keys}" )
+        if mask in self.chords:
+            raise Exception( f"Chord {keys} is already bound to a function. Use the `drop_chord` function to release the binding before rebinding the chord" )
+
+        self.chords[ mask ] = ( callback, kwargs or {} )
+        self._compile_chords()
+
+    def _compile_chords( self ):
+        '''
+        rebuild the chord lookups: the keys that take part in any chord, and every
+          partial chord, the key masks worth waiting on for more keys
+        '''
+        self.chord_keys = 0
+        self.chord_prefixes = set()
+        for mask in self.chords:
+            self.chord_keys |= mask
+            sub = ( mask - 1 ) & mask
+            while sub:
+                self.chord_prefixes.add( sub )
+                sub = ( sub - 1 ) & mask
+
+    def bind_effect( self, key_num, animation, event=PRESS ):
+        '''
+        play an led animation on a key whenever it produces an event
+        '''
+        key_num = int( key_num )
+        self.check_key( key_num )
+        self.effects[ key_num ] = ( event, animation )
+
+    def bind_key( self, key_num, callback, color=None, kwargs=None, event=PRESS, repeat=None ):
+        '''
+        bind a callback to a key event, and optionally set the key's color in the frame
+        '''
+        key_num = int( key_num )
+        self.check_key( key_num )
+        if key_num in self.bindings or key_num in self.layer_keys:
+            raise Exception( f"Key {key_num} is already bound to a function. Use the `drop_key` function to release the binding before rebinding the key" )
+
+        if repeat:
+            if event == RELEASE:
+                raise Exception( f"Key {key_num} can't repeat on RELEASE, the key is no longer held. Bind it to PRESS or HOLD" )
+            if not repeat[1] > 0:
+                raise Exception( f"Key {key_num} can't repeat {repeat[1]} times per second, the rate has to be above 0" )
+            repeat = ( int( repeat[0] * 1000000 ), 1000000000 // repeat[1] )
+        self.bindings[ key_num ] = callback
+        self.table[ key_num ] = ( event, callback, kwargs or {}, repeat or None )
+        self.bound_mask |= 1 << key_num
+        if color:
+            self.set_color( key_num, color[0], color[1], color[2] )
+
+    def bind_layer( self, key_num, name, momentary=False, color=None ):
+        '''
+        make a key switch to another layer
+        '''
+        key_num = int( key_num )
+        self.check_key( key_num )
+        if key_num in self.bindings or key_num in self.layer_keys:
+            raise Exception( f"Key {key_num} is already bound to a function. Use the `drop_key` function to release the binding before rebinding the key" )
+
+        self.layer_keys[ key_num ] = ( name, momentary )
+        self.bound_mask |= 1 << key_num
+        if color:
+            self.set_color( key_num, color[0], color[1], color[2] )
+
+    def drop_chord( self, keys ):
+        '''
+        remove the binding on a chord
+        '''
+        mask = 0
+        for key_num in keys:
+            mask |= 1 << int( key_num )
+        if mask in self.chords:
+            self.chords.pop( mask )
+            self._compile_chords()
+
+    def drop_key( self, key_num ):
+        '''
+        remove the binding or layer switch on a key
+        '''
+        key_num = int( key_num )
+        if key_num in self.bindings:
+            self.bindings.pop( key_num )
+            self.table[ key_num ] = None
+        elif key_num in self.layer_keys:
+            self.layer_keys.pop( key_num )
+        else:
+            return
+        self.bound_mask &= ~( 1 << key_num )
+
+    def is_bound( self, key_num ):
+        '''
+        check to see if a key is bound on this layer
+        '''
+        return int( key_num ) in self.bindings or int( key_num ) in self.layer_keys
+
+    def set_color( self, key_num, r, g, b ):
+        '''
+        set a key's color in the layer's frame
+        '''
+        i = 3 * int( key_num )
+        self.colors[i] = r
+        self.colors[i+1] = g
+        self.colors[i+2] = b
+
+
+# 1m.
 class MacroPad( Pad ):
     '''
-    Macro Pad instance
+    Macro Pad instance. Bindings live on layers: the pad starts on a layer named "base",
+      and `add_layer` creates more. Binding methods act on the active layer unless a
+      layer name is given
     '''
-    def __init__( self, **kwargs ):
+    def __init__( self, chord_window=50, macro_queue=16, queue_policy=FIFO, **kwargs ):
+        '''
+        :param int chord_window: ms to wait after the first key of a possible chord for
+            the rest of it before treating the keys as single presses
+        :param int macro_queue: number of callbacks kept waiting to run
+        :param int queue_policy: what a press does when its key's callback is already
+            waiting or running: FIFO queues it, DROP_DUPLICATES ignores it and REPLACE
+            cancels the other
+        '''
         super().__init__( **kwargs )
-        self._bindings = {}
+        self._listeners = []
+
+        # layers, the active one is the only one dispatched from
+        self._layer = Layer( "base", self._nkeys, self._framebuffer.colors )
+        self._layers = { "base": self._layer }
+        self._layer_return = None
+
+        # chord keys pressed and waiting for the rest of the chord
+        self._chord_window = chord_window * 1000000
+        self._pending = 0
+        self._pending_since = 0
+
+        # typematic repeats of held keys: key num to [due ns, period ns, callback, kwargs]
+        self._repeats = {}
+
+        # callbacks waiting to run, and the one running
+        self._queue = DispatchQueue( macro_queue, queue_policy )
+        self._running = None
+        self._cancel = False
+
+        # coroutine macros waiting for `run` as (name, coroutine), and the running tasks
+        self._macros = []
+        self._tasks = {}
+        self._running_macros = 0
 
     @property
     def bindings( self ):
         '''
-        dictionary where key bindings are defined
+        dictionary where the active layer's key bindings are defined
         '''
-        return self._bindings
+        return self._layer.bindings
 
     @property
     def bound_pressed_buttons( self ):
         '''
         returns a list of buttons that are both pressed and bound to something
         '''
-        bound_pressed = []
-        for key_num in self.pressed_keys:
-            if key_num in self._bindings:
-                bound_pressed.append( key_num )
+        return list( mask_keys( self._scanner.mask & self._layer.bound_mask ) )
+
+    @property
+    def chords( self ):
+        '''
+        dictionary of the active layer's chord bindings, keyed by the bitmask of the
+          chord's keys
+        '''
+        return self._layer.chords
 
-        return bound_pressed
+    @property
+    def queue( self ):
+        '''
+        the DispatchQueue of callbacks waiting to run
+        '''
+        return self._queue
+
+    @property
+    def layer( self ):
+        '''
+        the active Layer
+        '''
+        return self._layer
+
+    @property
+    def layers( self ):
+        '''
+        dictionary of layer name to Layer
+        '''
+        return self._layers
+
+    def _get_layer( self, name ):
+        if name is None:
+            return self._layer
+        if name not in self._layers:
+            raise Exception( f"No layer named {name}. Use the `add_layer` function to create it" )
+        return self._layers[ name ]
+
+    def add_layer( self, name, colors=None ):
+        '''
+        create a new layer of bindings. Its keys start with the pad's current colors
+          unless colors are given
 
-    def bind_key( self, key_num, callback, color=None ):
+        :arg str name: the layer's name
+        :arg colors: a list of [r,g,b] starting at key 0, or a dict of key num to [r,g,b]
+        @return Layer
         '''
-        Binds a callback function to a key to run when the key is pressed
+        if name in self._layers:
+            raise Exception( f"Layer {name} already exists" )
+        layer = Layer( name, self._nkeys, self._framebuffer.colors )
+        if colors:
+            items = colors.items() if hasattr( colors, "items" ) else enumerate( colors )
+            for key_num, rgb in items:
+                layer.check_key( key_num )
+                layer.set_color( key_num, rgb[0], rgb[1], rgb[2] )
+        self._layers[ name ] = layer
+        return layer
+
+    def switch_layer( self, name ):
+        '''
+        make another layer the active one. Its bindings take over straight away and its
+          colors go to the strip in one frame. The colors of the layer being left, as
+          they are on the strip, are kept for when it's switched back to, and keys held
+          on it stop repeating
+
+        :arg str name: name of the layer to switch to
+        '''
+        layer = self._get_layer( name )
+        if layer is self._layer:
+            return
+        self._animator.stop_all()
+        self._layer.colors[:] = self._framebuffer.colors
+        self._pending = 0
+        self._repeats.clear()
+        self._layer = layer
+        self._framebuffer.load( layer.colors )
+        if self._stats is not None:
+            self._stats.count( "layer.switches" )
+
+    def add_listener( self, callback ):
+        '''
+        register a function that gets every key event `dispatch` handles, bound or not
+
+        :arg FunctionType callback: function called with the KeyEvent
+        '''
+        self._listeners.append( callback )
+
+    def bind_chord( self, keys, callback, kwargs=None, layer=None ):
+        '''
+        Binds a callback function to a combination of keys pressed together, e.g. 0+3.
+          Presses of keys that take part in a chord wait up to chord_window ms for the
+          rest of the chord; if it doesn't form they run their own PRESS bindings
+
+        :arg list keys: the key int vals of the chord, at least 2
+        :arg FunctionType callback: function to call when the chord is pressed
+        :arg dict kwargs: keyword arguments `dispatch` passes to the callback
+        :arg str layer: name of the layer to bind on, the active layer if not given
+        '''
+        self._get_layer( layer ).bind_chord( keys, callback, kwargs )
+
+    def bind_effect( self, key_num, animation, event=PRESS, layer=None ):
+        '''
+        play an led animation on a key whenever it produces an event
+
+        :arg int key_num: key int val to bind
+        :arg Animation animation: the animation to play
+        :arg int event: the event that starts the animation, PRESS, RELEASE or HOLD
+        :arg str layer: name of the layer to bind on, the active layer if not given
+        '''
+        self._get_layer( layer ).bind_effect( key_num, animation, event )
+
+    def bind_key( self, key_num, callback, color=None, kwargs=None, event=PRESS, layer=None, repeat=None ):
+        '''
+        Binds a callback function to a key to run when the key is pressed. If the
+          callback returns a coroutine (an AsyncDuckyEngine script for example) it is
+          queued as a macro for `run`. With repeat, the callback runs again and again
+          while the key stays held, like a keyboard's typematic repeat; `dispatch` runs
+          the repeats from its timers, so a held key never blocks the others or reads
+          the bus
 
         :arg int key_num: key int val to bind
         :arg FunctionType callback: function to call when the key is pressed
         :arg list color: a list with 3 integers denoting the color of the button
             [r,g,b] from [0-255]
+        :arg dict kwargs: keyword arguments `dispatch` passes to the callback
+        :arg int event: the event that runs the callback, PRESS, RELEASE or HOLD
+        :arg str layer: name of the layer to bind on, the active layer if not given
+        :arg tuple repeat: ( ms before the first repeat, repeats per second ), None to not
+            repeat. Only for PRESS and HOLD bindings
         '''
-        # do some error checking
-        key_num = int( key_num )
-        self.check_key( key_num )
-        if key_num in self._bindings:
-            raise Exception( f"Key {key_num} is already bound to a function. Use the `drop_key` function to release the binding before rebinding the key" )
-
-        # bind the key
-        self._bindings[ key_num ] = callback
+        target = self._get_layer( layer )
+        target.bind_key( key_num, callback, color, kwargs, event, repeat )
 
         # set the color
-        if color:
-            self.keys[ key_num ].led.set( color[0], color[1], color[2] )
+        if color and target is self._layer:
+            self.keys[ int( key_num ) ].led.set( color[0], color[1], color[2] )
+
+    def bind_layer( self, key_num, name, momentary=False, color=None, layer=None ):
+        '''
+        Make a key switch to another layer. A toggle key switches on press, and pressing
+          it again switches back to the layer it came from; a momentary key switches
+          back when it's released
+
+        :arg int key_num: key int val to bind
+        :arg str name: name of the layer the key switches to
+        :arg bool momentary: only stay on the layer while the key is held
+        :arg list color: [r,g,b] color of the key
+        :arg str layer: name of the layer to bind on, the active layer if not given
+        '''
+        self._get_layer( name )
+        target = self._get_layer( layer )
+        target.bind_layer( key_num, name, momentary, color )
+        if color and target is self._layer:
+            self.keys[ int( key_num ) ].led.set( color[0], color[1], color[2] )
+
+    def load_config( self, path, engine=None, actions=None ):
+        '''
+        Bind keys from a JSON config file. The config is checked and its ducky scripts
+          compiled once, into a compiled config written next to it (the name plus
+          CONFIG_SUFFIX) that later boots load instead, until the config's size or mtime
+          changes. Layers that don't exist yet are created. A config that fails to bind
+          leaves the pad as it was and isn't compiled
+
+            {
+                "layers": {
+                    "base": {
+                        "colors": { "15": [ 0, 0, 255 ] },
+                        "keys": {
+                            "0": { "script": "STRING hello", "color": [ 0, 255, 0 ] },
+                            "1": { "file": "spotify.txt", "event": "hold" },
+                            "2": { "call": "volume", "kwargs": { "step": 2 }, "repeat": [ 500, 10 ] },
+                            "15": { "layer": "media", "momentary": true }
+                        },
+                        "chords": [ { "keys": [ 0, 1 ], "script": "GUI L" } ]
+                    },
+                    "media": { "keys": {} }
+                }
+            }
+
+          A config with a single layer can give its "keys", "chords" and "colors" at the
+          top level instead, for the base layer. Each binding runs one of: an inline
+          ducky "script", a script "file" run with `DuckyEngine.script_file`, or a
+          function from actions to "call"
+
+        :arg str path: path of the config file
+        :arg DuckyEngine engine: engine that compiles and runs the scripts, only needed
+            if the config has scripts or files
+        :arg dict actions: function name to function, for the "call" bindings
+        '''
+        started = time.monotonic_ns()
+        stat = os.stat( path )
+        stamp = struct.pack( "<4sII", CONFIG_MAGIC, stat[6], stat[8] & 0xFFFFFFFF )
+        cache_path = path + CONFIG_SUFFIX
+        config = None
+        try:
+            infile = open( cache_path, "rb" )
+        except OSError:
+            infile = None
+        if infile is not None:
+            with infile:
+                if infile.read( len( stamp ) ) == stamp:
+                    config, scripts = self._read_config( infile, engine )
+        if config is None:
+            import json
+
+            with open( path, "r", encoding="utf-8" ) as infile:
+                config = json.load( infile )
+            scripts = []
+            config = self._compile_config( config, engine, scripts )
+            self._apply_config( config, scripts, engine, actions or {} )
+            # only a config that bound cleanly is written for the next boots
+            self._write_config( cache_path, stamp, config, scripts )
+        else:
+            self._apply_config( config, scripts, engine, actions or {} )
+        self._boot_stage( "config", started )
+
+    def _compile_config( self, config, engine, scripts ):
+        '''
+        check a parsed config and turn it into its compiled form: every layer with its
+          colors, keys and chords as lists, event names as event kinds, and each inline
+          script compiled into scripts and replaced by its index there
+        @return dict
+        '''
+        layers = config.get( "layers" )
+        if layers is None:
+            layers = { "base": config }
+        compiled = {}
+        indexes = {}
+        for name, spec in layers.items():
+            colors = spec.get( "colors" ) or {}
+            items = colors.items() if hasattr( colors, "items" ) else enumerate( colors )
+            keys = []
+            for key_num, binding in ( spec.get( "keys" ) or {} ).items():
+                self.check_key( int( key_num ) )
+                keys.append( [ int( key_num ), self._compile_binding( binding, engine, scripts, indexes, layers ) ] )
+            chords = []
+            for binding in spec.get( "chords" ) or []:
+                if "layer" in binding:
+                    raise Exception( f"Chord {binding.get('keys')} can't switch layer" )
+                chords.append( self._compile_binding( binding, engine, scripts, indexes, layers ) )
+            compiled[ name ] = {
+                "colors": [ [ int( key_num ), list( rgb ) ] for key_num, rgb in items ],
+                "keys": keys,
+                "chords": chords,
+            }
+        return { "layers": compiled, "scripts": len( scripts ) }
+
+    def _compile_binding( self, binding, engine, scripts, indexes, layers ):
+        binding = dict( binding )
+        actions = [ kind for kind in ( "script", "file", "call", "layer" ) if kind in binding ]
+        if len( actions ) != 1:
+            raise Exception( f"A binding needs one of script, file, call or layer, got {binding}" )
+        if actions[0] in ( "script", "file" ) and engine is None:
+            raise Exception( "Binding ducky scripts needs a DuckyEngine, pass it as `engine`" )
+        if actions[0] == "layer" and binding[ "layer" ] not in layers and binding[ "layer" ] not in self._layers:
+            raise Exception( f"No layer named {binding['layer']} in the config" )
+        if "script" in binding:
+            text = binding.pop( "script" )
+            if text not in indexes:
+                indexes[ text ] = len( scripts )
+                scripts.append( engine.compile( text ) )
+            binding[ "ops" ] = indexes[ text ]
+        event = binding.get( "event", "press" )
+        if event not in EVENT_NAMES:
+            raise Exception( f"Unknown event {event}, use one of {list( EVENT_NAMES )}" )
+        binding[ "event" ] = EVENT_NAMES[ event ]
+        return binding
+
+    def _read_config( self, infile, engine ):
+        '''
+        read a compiled config after its header
+        @return ( config dict, list of CompiledScript )
+        '''
+        import json
+
+        size = struct.unpack( "<I", infile.read( 4 ) )[0]
+        config = json.loads( str( infile.read( size ), "utf-8" ) )
+        if config[ "scripts" ] and engine is None:
+            raise Exception( "Binding ducky scripts needs a DuckyEngine, pass it as `engine`" )
+        scripts = []
+        for i in range( config[ "scripts" ] ):
+            size = struct.unpack( "<I", infile.read( 4 ) )[0]
+            scripts.append( engine.decode_script( infile.read( size ) ) )
+        return config, scripts
+
+    def _write_config( self, cache_path, stamp, config, scripts ):
+        import json
+
+        records = []
+        for script in scripts:
+            data = script.engine.encode_script( script )
+            if data is None:
+                # an op too long for a record, compile the config again next time
+                return
+            records.append( data )
+        body = json.dumps( config ).encode( "utf-8" )
+
+        # write to a temporary file, renamed into place once complete
+        temp_path = cache_path + ".tmp"
+        try:
+            with open( temp_path, "wb" ) as out:
+                out.write( stamp )
+                out.write( struct.pack( "<I", len( body ) ) )
+                out.write( body )
+                for data in records:
+                    out.write( struct.pack( "<I", len( data ) ) )
+                    out.write( data )
+            try:
+                os.remove( cache_path )
+            except OSError:
+                pass
+            os.rename( temp_path, cache_path )
+        except OSError:
+            # read only drive, compile the config again next time
+            try:
+                os.remove( temp_path )
+            except OSError:
+                pass
+
+    def _apply_config( self, config, scripts, engine, actions ):
+        '''
+        bind everything in a compiled config. If a binding fails, the bindings and
+          layers made before it are dropped again, so the pad is left as it was
+        '''
+        layers = config[ "layers" ]
+        added = [ name for name in layers if name not in self._layers ]
+        for name in added:
+            self.add_layer( name )
+        bound = []
+        try:
+            for name, spec in layers.items():
+                layer = self._layers[ name ]
+                for key_num, rgb in spec[ "colors" ]:
+                    layer.set_color( key_num, rgb[0], rgb[1], rgb[2] )
+                    if layer is self._layer:
+                        self.keys[ key_num ].led.set( rgb[0], rgb[1], rgb[2] )
+                for key_num, binding in spec[ "keys" ]:
+                    if "layer" in binding:
+                        self.bind_layer( key_num, binding[ "layer" ], binding.get( "momentary", False ), binding.get( "color" ), name )
+                    else:
+                        callback = self._config_callback( binding, scripts, engine, actions )
+                        self.bind_key( key_num, callback, binding.get( "color" ), binding.get( "kwargs" ), binding[ "event" ], name, binding.get( "repeat" ) )
+                    bound.append( ( self.drop_key, key_num, name ) )
+                for binding in spec[ "chords" ]:
+                    callback = self._config_callback( binding, scripts, engine, actions )
+                    self.bind_chord( binding[ "keys" ], callback, binding.get( "kwargs" ), name )
+                    bound.append( ( self.drop_chord, binding[ "keys" ], name ) )
+        except Exception:
+            for drop, keys, name in bound:
+                drop( keys, name )
+            for name in added:
+                del self._layers[ name ]
+            raise
+
+    def _config_callback( self, binding, scripts, engine, actions ):
+        if "ops" in binding:
+            return scripts[ binding[ "ops" ] ]
+        if "file" in binding:
+            return engine.script_file( binding[ "file" ] )
+        if binding[ "call" ] not in actions:
+            raise Exception( f"No action named {binding['call']}, pass it in `actions`" )
+        return actions[ binding[ "call" ] ]
 
     def call( self, key_num, **kwargs ):
         '''
@@ -279,21 +1728,261 @@ class MacroPad( Pad ):
         self.check_key( key_num )
 
         # run the function
-        self._bindings[ key_num ]( **kwargs )
+        self._layer.bindings[ key_num ]( **kwargs )
 
-    def drop_key( self, key_num ):
+    def dispatch( self ):
         '''
-        remove the binding on a given key
+        update the keypad, queue the callbacks bound to the events it produced and run
+          the queue. Each press runs its binding once, however long the key is held, so
+          the main loop can call this as often as it likes without sleeping between
+          presses. Presses `poll` catches while a callback runs are run before returning
+        @return int number of callbacks run
+        '''
+        self.update()
+        self._collect()
+        ran = 0
+        job = self._queue.pop()
+        while job is not None:
+            self._run_job( job )
+            ran += 1
+            job = self._queue.pop()
+        return ran
 
-        :arg int key_num: key int val to drop from bindings
+    def poll( self ):
         '''
-        # do some error checking
-        key_num = int( key_num )
-        if key_num not in self._bindings:
+        Update the keypad if a scan is due and queue the callbacks bound to the events
+          it produced, without running them. Give it to a DuckyEngine as its idle hook so
+          presses are caught while a macro runs, to be run once it's done:
+
+            de.idle = pad.poll
+
+        @return bool True if the running callback should stop, because the REPLACE
+            policy queued a new press of its key
+        '''
+        if not self.scan_interval:
+            self.update()
+            self._collect()
+        return self._cancel
+
+    def _collect( self ):
+        '''
+        turn the queued key events into queued callbacks
+        '''
+        if self._stats is not None:
+            self._stats.poll_console()
+        event = self._events.pop()
+        while event is not None:
+            for listener in self._listeners:
+                listener( event )
+            layer = self._layer
+            key_num = event.key
+            bit = 1 << key_num
+            if key_num in layer.effects and layer.effects[ key_num ][0] == event.kind:
+                self._animator.play( key_num, layer.effects[ key_num ][1] )
+
+            # layer switches, and the key that leads back from a toggled or held layer
+            if self._layer_return is not None and key_num == self._layer_return[0]:
+                name, momentary = self._layer_return[1:]
+                if event.kind == ( RELEASE if momentary else PRESS ):
+                    self._layer_return = None
+                    self.switch_layer( name )
+                event = self._events.pop()
+                continue
+            if key_num in layer.layer_keys:
+                if event.kind == PRESS:
+                    name, momentary = layer.layer_keys[ key_num ]
+                    self._layer_return = ( key_num, layer.name, momentary )
+                    self.switch_layer( name )
+                event = self._events.pop()
+                continue
+
+            # presses of chord keys wait for the rest of the chord
+            if event.kind == PRESS and bit & layer.chord_keys:
+                if not self._pending:
+                    self._pending_since = event.time
+                self._pending |= bit
+                # no bigger chord can still form, so don't wait out the window
+                if self._pending not in layer.chord_prefixes:
+                    self._resolve_chord()
+                event = self._events.pop()
+                continue
+            if event.kind == RELEASE:
+                if bit & self._pending:
+                    self._resolve_chord()
+                if key_num in self._repeats:
+                    del self._repeats[ key_num ]
+
+            entry = layer.table[ key_num ]
+            if entry is not None and entry[0] == event.kind:
+                self._enqueue( key_num, entry[1], entry[2] )
+                if entry[3] is not None:
+                    self._start_repeat( key_num, entry, event.time )
+            event = self._events.pop()
+
+        now = time.monotonic_ns()
+
+        # the chord window closed without the chord forming
+        if self._pending and now - self._pending_since >= self._chord_window:
+            self._resolve_chord()
+
+        # typematic repeats that are due
+        if self._repeats:
+            for key_num, timer in self._repeats.items():
+                if now >= timer[0]:
+                    self._enqueue( key_num, timer[2], timer[3] )
+                    # keep to the original schedule, skipping repeats missed by a late
+                    # dispatch rather than bursting them
+                    timer[0] += timer[1]
+                    if timer[0] <= now:
+                        timer[0] += ( now - timer[0] ) // timer[1] * timer[1] + timer[1]
+
+    def _enqueue( self, name, callback, kwargs ):
+        '''
+        queue a callback. The queue policy also covers a callback of the same name that
+          is running now or as a macro: DROP_DUPLICATES ignores the new one, REPLACE
+          stops the old one
+        '''
+        policy = self._queue.policy
+        if policy != FIFO:
+            waiting = None
+            for macro in self._macros:
+                if macro[0] == name:
+                    waiting = macro
+            if name == self._running or name in self._tasks or waiting is not None:
+                if policy == DROP_DUPLICATES:
+                    self._queue.duplicates += 1
+                    return
+                if name == self._running:
+                    self._cancel = True
+                if name in self._tasks:
+                    self._tasks.pop( name ).cancel()
+                if waiting is not None:
+                    self._macros.remove( waiting )
+                    waiting[1].close()
+                self._queue.replaced += 1
+        self._queue.push( name, callback, kwargs )
+
+    def _run_job( self, job ):
+        name, callback, kwargs = job
+        self._running = name
+        self._cancel = False
+        try:
+            self._call_binding( name, callback, kwargs )
+        finally:
+            self._running = None
+            self._cancel = False
+
+    def _start_repeat( self, key_num, entry, pressed_at ):
+        '''
+        schedule the typematic repeats of a key that just queued its binding
+        '''
+        delay, period = entry[3]
+        self._repeats[ key_num ] = [ pressed_at + delay, period, entry[1], entry[2] ]
+
+    def _call_binding( self, name, callback, kwargs ):
+        '''
+        run a bound callback, queueing it as a macro if it returns a coroutine
+        '''
+        if self._stats is None:
+            result = callback( **kwargs )
+        else:
+            started = time.monotonic_ns()
+            result = callback( **kwargs )
+            self._stats.record( f"callback.{name}", time.monotonic_ns() - started )
+        if hasattr( result, "send" ):
+            self._macros.append( ( name, result ) )
+
+    def _resolve_chord( self ):
+        '''
+        queue the chord bound to the pending keys, or else each pending key's own press
+          binding, and clear the pending keys
+        '''
+        layer = self._layer
+        pending = self._pending
+        self._pending = 0
+        chord = layer.chords.get( pending )
+        if chord is not None:
+            self._enqueue( f"chord{pending:#x}", chord[0], chord[1] )
             return
 
+        for key_num in mask_keys( pending ):
+            entry = layer.table[ key_num ]
+            if entry is not None and entry[0] == PRESS:
+                self._enqueue( key_num, entry[1], entry[2] )
+                if entry[3] is not None and self._stable >> key_num & 1:
+                    self._start_repeat( key_num, entry, time.monotonic_ns() )
+
+    def drop_key( self, key_num, layer=None ):
+        '''
+        remove the binding on a given key
+
+        :arg int key_num: key int val to drop from bindings
+        :arg str layer: name of the layer to drop from, the active layer if not given
+        '''
         if self.valid_key( key_num ):
-            func = self._bindings.pop( key_num )
+            target = self._get_layer( layer )
+            target.drop_key( key_num )
+            # a key held down stops repeating the binding it no longer has
+            if target is self._layer:
+                self._repeats.pop( int( key_num ), None )
+
+    def drop_chord( self, keys, layer=None ):
+        '''
+        remove the binding on a chord
+
+        :arg list keys: the key int vals of the chord
+        :arg str layer: name of the layer to drop from, the active layer if not given
+        '''
+        self._get_layer( layer ).drop_chord( keys )
+
+    async def run( self, scan_rate=None, max_macros=1 ):
+        '''
+        Run the pad on the asyncio event loop. The scan loop updates the keypad and
+          dispatches events at the scan scheduler's rate, while coroutines returned by
+          callbacks run as separate macro tasks, so scanning continues while a macro
+          awaits its delays. Macros beyond max_macros wait their turn in press order
+
+            asyncio.run( pad.run() )
+
+        :arg int scan_rate: fixed scans per second, None to follow the scheduler
+        :arg int max_macros: number of macros allowed to run at the same time
+        '''
+        import asyncio
+
+        period = 1000000000 // scan_rate if scan_rate else None
+        deadline = time.monotonic_ns()
+        while True:
+            self.dispatch()
+
+            # start queued macros
+            while self._macros and self._running_macros < max_macros:
+                self._running_macros += 1
+                name, macro = self._macros.pop(0)
+                self._tasks[ name ] = asyncio.create_task( self._run_macro( name, macro ) )
+
+            if period is None:
+                # keep scanning at the active rate while macros run
+                if self._running_macros:
+                    self._scheduler.wake()
+                await asyncio.sleep( self.scan_interval )
+                continue
+
+            # wait for the next scan, skipping missed ones rather than bursting
+            deadline += period
+            now = time.monotonic_ns()
+            if deadline < now:
+                deadline = now
+            await asyncio.sleep( ( deadline - now ) / 1000000000 )
+
+    async def _run_macro( self, name, macro ):
+        import asyncio
+
+        try:
+            await macro
+        finally:
+            self._running_macros -= 1
+            if self._tasks.get( name ) is asyncio.current_task():
+                del self._tasks[ name ]
 
     def is_bound( self, key_num ):
         '''
@@ -302,5 +1991,32 @@ class MacroPad( Pad ):
         :arg int key_num: key int value to check for binding
         @return bool
         '''
-        return int(key_num) in self._bindings
+        return self._layer.is_bound( key_num )
+
+
+# 2. Functions ---
 
+_gamma_tables = {}
+
+def gamma_table( gamma=2.2, brightness=1.0 ):
+    '''
+    256 byte lookup table mapping a color channel to its gamma corrected, brightness
+      scaled value. Tables are built once and shared
+    '''
+    table = _gamma_tables.get( (gamma, brightness) )
+    if table is None:
+        table = bytes( int( ( i / 255 ) ** gamma * 255 * brightness + 0.5 ) for i in range( 256 ) )
+        _gamma_tables[ (gamma, brightness) ] = table
+    return table
+
+
+def mask_keys( mask ):
+    '''
+    yield the number of every key set in a key bitmask, lowest first
+    '''
+    key = 0
+    while mask:
+        if mask & 1:
+            yield key
+        mask >>= 1
+        key += 1
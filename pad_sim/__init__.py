@@ -0,0 +1,323 @@
+# pad_sim/__init__.py
+
+__author__ = "thekraftyman"
+
+'''
+Host-side hardware simulator for the pico keypad.
+
+Provides drop-in fakes for the CircuitPython modules that pad_lib.py, ducky_engine.py and
+adafruit_dotstar.py import (board, busio, digitalio, pwmio, supervisor, usb_hid,
+adafruit_pixelbuf, adafruit_bus_device and adafruit_hid), so they run unmodified under
+CPython. Every i2c transaction, spi write and hid report is recorded with a virtual
+timestamp, and key presses are scripted on a timeline:
+
+    import pad_sim
+    sim = pad_sim.install()
+
+    from pad_lib import MacroPad
+    pad = MacroPad()
+    sim.keypad.tap( 3, at=10, duration=40 )
+'''
+
+import os
+import sys
+import time as _time
+import types
+
+# --------------
+# CONTENTS
+# 1. Classes
+#   a. Clock
+#   b. Expander
+#   c. Simulator
+# 2. Functions
+# --------------
+
+MODULES = os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), "modules" )
+
+_current = None
+
+# 1. Classes ---
+
+# 1a.
+class Clock:
+    '''
+    Time source for the simulation. In virtual mode time only moves when the code under
+      test sleeps or the simulated hardware spends time on a transfer, so runs are
+      repeatable. Otherwise it follows the host's monotonic clock
+    '''
+    def __init__( self, virtual=True ):
+        '''
+        :param bool virtual: use virtual time instead of the host clock
+        '''
+        self.virtual = virtual
+        self._origin = _time.monotonic_ns()
+        self._now = 0
+
+    def now( self ):
+        '''
+        nanoseconds since the simulation started
+        '''
+        if self.virtual:
+            return self._now
+        return _time.monotonic_ns() - self._origin
+
+    def advance( self, ns ):
+        '''
+        move virtual time forward (no-op on the host clock)
+        '''
+        if self.virtual and ns > 0:
+            self._now += int( ns )
+
+    def sleep( self, seconds ):
+        if self.virtual:
+            self.advance( seconds * 1000000000 )
+        elif seconds > 0:
+            _time.sleep( seconds )
+
+
+# 1b.
+class Expander:
+    '''
+    TCA9555 style 16 bit i2c port expander with the keys wired active low. Key presses
+      are scripted as a timeline of (time, key, pressed) changes. Like the real part,
+      its active low interrupt line goes low when the keys differ from the last read
+      and goes back high on the next read
+    '''
+    def __init__( self, sim, address=0x20, nkeys=16 ):
+        '''
+        :param Simulator sim: the owning simulator
+        :param int address: i2c address of the expander
+        :param int nkeys: number of keys wired to the expander
+        '''
+        self._sim = sim
+        self.address = address
+        self.nkeys = nkeys
+        self.register = 0
+        self.reads = 0
+        self._mask = 0
+        self._read_mask = 0
+        self._timeline = []
+
+    @property
+    def mask( self ):
+        '''
+        bitmask of the keys held down right now
+        '''
+        now = self._sim.clock.now()
+        timeline = self._timeline
+        while timeline and timeline[0][0] <= now:
+            at, key, pressed = timeline.pop(0)
+            if pressed:
+                self._mask |= 1 << key
+            else:
+                self._mask &= ~( 1 << key )
+        return self._mask
+
+    @property
+    def interrupt( self ):
+        '''
+        level of the interrupt line, False while a change hasn't been read
+        '''
+        return self.mask == self._read_mask
+
+    def wire_interrupt( self, pin ):
+        '''
+        connect the interrupt line to a board pin. The line is open drain, so expanders
+          wired to the same pin pull it low together
+        '''
+        other = self._sim.pins.get( pin )
+        if other is None:
+            self._sim.pins[ pin ] = lambda: self.interrupt
+        else:
+            self._sim.pins[ pin ] = lambda: self.interrupt and other()
+
+    def _at( self, at ):
+        now = self._sim.clock.now()
+        if at is None:
+            return now
+        return now + int( at * 1000000 )
+
+    def press( self, key, at=None ):
+        '''
+        press a key at ms from now (now if not given)
+        '''
+        self._schedule( self._at( at ), key, True )
+
+    def release( self, key, at=None ):
+        '''
+        release a key at ms from now (now if not given)
+        '''
+        self._schedule( self._at( at ), key, False )
+
+    def tap( self, key, at=None, duration=50 ):
+        '''
+        press a key and release it duration ms later
+        '''
+        start = self._at( at )
+        self._schedule( start, key, True )
+        self._schedule( start + int( duration * 1000000 ), key, False )
+
+    def script( self, timeline ):
+        '''
+        schedule a list of (ms from now, key, pressed) changes
+        '''
+        for at, key, pressed in timeline:
+            self._schedule( self._at( at ), key, pressed )
+
+    def _schedule( self, at, key, pressed ):
+        if not 0 <= key < self.nkeys:
+            raise ValueError( f"Key {key} not wired to expander 0x{self.address:02x}" )
+        self._timeline.append( (at, key, pressed) )
+        self._timeline.sort( key=lambda change: change[0] )
+
+    def write( self, data ):
+        if data:
+            self.register = data[0]
+
+    def read( self, nbytes ):
+        '''
+        read from the current register, auto incrementing through the port pair
+        '''
+        self.reads += 1
+        self._read_mask = self.mask
+        port = ~self._read_mask & 0xFFFF
+        out = bytearray( nbytes )
+        register = self.register
+        for i in range( nbytes ):
+            if register & 1:
+                out[i] = port >> 8 & 0xFF
+            else:
+                out[i] = port & 0xFF
+            register ^= 1
+        return out
+
+
+# 1c.
+class Simulator:
+    '''
+    Shared state of the simulated board: clock, wired i2c devices, bus and usb logs
+    '''
+    def __init__( self, virtual_time=True, hardware_spi=True, usb_connected=True, report_interval=0.001 ):
+        '''
+        :param bool virtual_time: run on a virtual clock instead of the host clock
+        :param bool hardware_spi: if False busio.SPI raises, forcing bit-banged spi
+        :param usb_connected: value reported by supervisor.runtime.usb_connected, or the
+            ms after start at which the host finishes enumerating the device
+        :param float report_interval: seconds the host takes to poll each hid report
+        '''
+        self.clock = Clock( virtual_time )
+        self.hardware_spi = hardware_spi
+        self.usb_connected = usb_connected
+        self.report_interval = report_interval
+
+        # wired devices
+        self.expanders = {}
+        self.keypad = self.add_expander( 0x20 )
+        self.pins = {}
+
+        # logs of (time ns, ...) records
+        self.i2c_log = []
+        self.spi_log = []
+        self.hid_log = []
+        self.pin_writes = 0
+        self.console = []
+
+    def add_expander( self, address, nkeys=16 ):
+        '''
+        wire another key expander onto the i2c bus
+        @return Expander
+        '''
+        expander = Expander( self, address, nkeys )
+        self.expanders[ address ] = expander
+        return expander
+
+    def i2c_transfer( self, frequency, address, kind, nbytes ):
+        '''
+        record an i2c transaction and spend its bus time: 9 clocks per byte plus the
+          address byte of each (repeated) start
+        '''
+        starts = 2 if kind == "wr" else 1
+        self.i2c_log.append( (self.clock.now(), address, kind, nbytes) )
+        self.clock.advance( ( nbytes + starts ) * 9 * 1000000000 // frequency )
+
+    def spi_write( self, baudrate, data ):
+        self.spi_log.append( (self.clock.now(), bytes( data )) )
+        self.clock.advance( len( data ) * 8 * 1000000000 // baudrate )
+
+    def hid_report( self, device, report ):
+        self.hid_log.append( (self.clock.now(), device.usage, bytes( report )) )
+        self.clock.advance( self.report_interval * 1000000000 )
+
+    def pin_level( self, pin ):
+        '''
+        level driven onto an input pin by simulated hardware, None if nothing drives it
+        '''
+        driver = self.pins.get( pin )
+        if driver is None:
+            return None
+        return driver()
+
+    def reset_logs( self ):
+        self.i2c_log = []
+        self.spi_log = []
+        self.hid_log = []
+        self.pin_writes = 0
+
+    @property
+    def spi_bytes( self ):
+        return sum( len( data ) for at, data in self.spi_log )
+
+    @property
+    def keyboard_reports( self ):
+        '''
+        hid reports sent to the keyboard device as (time ns, report bytes)
+        '''
+        return [ (at, report) for at, usage, report in self.hid_log if usage == 0x06 ]
+
+
+# 2. Functions ---
+
+def current():
+    '''
+    the simulator the fake modules are currently wired to
+    '''
+    if _current is None:
+        raise RuntimeError( "pad_sim is not installed, call pad_sim.install() first" )
+    return _current
+
+
+def _time_module():
+    '''
+    build a stand-in for the time module that answers from the simulator clock
+    '''
+    module = types.ModuleType( "time" )
+    for name in dir( _time ):
+        if not name.startswith( "__" ):
+            setattr( module, name, getattr( _time, name ) )
+
+    module.monotonic_ns = lambda: current().clock.now()
+    module.monotonic = lambda: current().clock.now() / 1000000000
+    module.sleep = lambda seconds: current().clock.sleep( seconds )
+    module.__pad_sim__ = True
+    return module
+
+
+def install( **kwargs ):
+    '''
+    wire a fresh simulator in and put the fake modules ahead of everything else on the
+      import path. Must be called before pad_lib or ducky_engine are imported. Calling
+      it again replaces the simulator behind the already imported fakes
+
+    keyword arguments are passed to Simulator
+    @return Simulator
+    '''
+    global _current
+    _current = Simulator( **kwargs )
+
+    if MODULES not in sys.path:
+        sys.path.insert( 0, MODULES )
+    if not getattr( sys.modules.get( "time" ), "__pad_sim__", False ):
+        sys.modules[ "time" ] = _time_module()
+
+    return _current
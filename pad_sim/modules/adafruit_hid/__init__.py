@@ -0,0 +1,15 @@
+# adafruit_hid/__init__.py - pad_sim stand-in for the adafruit_hid library
+
+__author__ = "thekraftyman"
+
+
+def find_device( devices, *, usage_page, usage ):
+    '''
+    search for a hid device with a given usage page and usage
+    '''
+    if hasattr( devices, "send_report" ):
+        devices = [ devices ]
+    for device in devices:
+        if device.usage_page == usage_page and device.usage == usage and hasattr( device, "send_report" ):
+            return device
+    raise ValueError( "Could not find matching HID device." )
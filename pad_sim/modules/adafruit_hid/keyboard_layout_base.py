@@ -0,0 +1,51 @@
+# adafruit_hid/keyboard_layout_base.py - pad_sim stand-in for adafruit_hid.keyboard_layout_base
+
+__author__ = "thekraftyman"
+
+import time
+
+from .keycode import Keycode
+
+
+class KeyboardLayoutBase:
+    '''
+    Map ASCII characters to keycodes, same interface as adafruit_hid 5.x
+    '''
+    SHIFT_FLAG = 0x80
+    SHIFT_CODE = 0xE1
+    ASCII_TO_KEYCODE = b""
+
+    def __init__( self, keyboard ):
+        self.keyboard = keyboard
+
+    def write( self, string, delay=None ):
+        '''
+        type a string, one press and release report pair per character
+        '''
+        for char in string:
+            keycode = self._char_to_keycode( char )
+            if keycode & self.SHIFT_FLAG:
+                keycode &= ~self.SHIFT_FLAG
+                self.keyboard.press( self.SHIFT_CODE )
+            self.keyboard.press( keycode )
+            self.keyboard.release_all()
+            if delay is not None:
+                time.sleep( delay )
+
+    def keycodes( self, char ):
+        '''
+        return a tuple of keycodes needed to type a character
+        '''
+        keycode = self._char_to_keycode( char )
+        if keycode & self.SHIFT_FLAG:
+            return ( self.SHIFT_CODE, keycode & ~self.SHIFT_FLAG )
+        return ( keycode, )
+
+    def _char_to_keycode( self, char ):
+        char_val = ord( char )
+        if char_val >= len( self.ASCII_TO_KEYCODE ):
+            raise ValueError( f"No keycode available for character {char} ({char_val}/0x{char_val:02x})." )
+        keycode = self.ASCII_TO_KEYCODE[ char_val ]
+        if keycode == 0:
+            raise ValueError( f"No keycode available for character {char} ({char_val}/0x{char_val:02x})." )
+        return keycode
@@ -0,0 +1,37 @@
+# adafruit_hid/keyboard_layout_us.py - pad_sim stand-in for adafruit_hid.keyboard_layout_us
+
+__author__ = "thekraftyman"
+
+from .keyboard_layout_base import KeyboardLayoutBase
+
+
+def _table():
+    shift = KeyboardLayoutBase.SHIFT_FLAG
+    table = bytearray( 128 )
+    for i in range( 26 ):
+        table[ ord( "a" ) + i ] = 0x04 + i
+        table[ ord( "A" ) + i ] = ( 0x04 + i ) | shift
+    for i, char in enumerate( "1234567890" ):
+        table[ ord( char ) ] = 0x1E + i
+    for i, char in enumerate( "!@#$%^&*()" ):
+        table[ ord( char ) ] = ( 0x1E + i ) | shift
+    plain = { "\b": 0x2A, "\t": 0x2B, "\n": 0x28, "\x1b": 0x29, " ": 0x2C, "-": 0x2D, "=": 0x2E,
+              "[": 0x2F, "]": 0x30, "\\": 0x31, ";": 0x33, "'": 0x34, "`": 0x35, ",": 0x36,
+              ".": 0x37, "/": 0x38, "\x7f": 0x4C }
+    shifted = { "_": 0x2D, "+": 0x2E, "{": 0x2F, "}": 0x30, "|": 0x31, ":": 0x33, '"': 0x34,
+                "~": 0x35, "<": 0x36, ">": 0x37, "?": 0x38 }
+    for char, keycode in plain.items():
+        table[ ord( char ) ] = keycode
+    for char, keycode in shifted.items():
+        table[ ord( char ) ] = keycode | shift
+    return bytes( table )
+
+
+class KeyboardLayoutUS( KeyboardLayoutBase ):
+    '''
+    Map ASCII characters to the US keyboard layout
+    '''
+    ASCII_TO_KEYCODE = _table()
+
+
+KeyboardLayout = KeyboardLayoutUS
@@ -0,0 +1,104 @@
+# adafruit_pixelbuf.py - pad_sim stand-in for the CircuitPython adafruit_pixelbuf module
+
+__author__ = "thekraftyman"
+
+
+class PixelBuf:
+    '''
+    Pure python pixel buffer with the same behavior as the CircuitPython core one:
+      colors are stored with brightness applied, in the strip's byte order, between
+      the header and trailer bytes, and the whole buffer is handed to _transmit on show
+    '''
+    def __init__( self, n, *, byteorder="BGR", brightness=1.0, auto_write=False, header=None, trailer=None ):
+        if "W" in byteorder:
+            raise ValueError( "RGBW strips are not simulated" )
+        self._byteorder = byteorder
+        self._dotstar_mode = byteorder[0] == "P"
+        order = byteorder[1:] if self._dotstar_mode else byteorder
+        self._offsets = tuple( order.index( c ) for c in "RGB" )
+        self._bpp = 4 if self._dotstar_mode else 3
+        self._pixel_offset = 1 if self._dotstar_mode else 0
+
+        self._n = n
+        self._header = bytes( header or b"" )
+        self._trailer = bytes( trailer or b"" )
+        self._colors = [ (0, 0, 0) ] * n
+        self._buffer = bytearray( self._header ) + bytearray( n * self._bpp ) + bytearray( self._trailer )
+        self._brightness = min( max( brightness, 0.0 ), 1.0 )
+        self.auto_write = False
+        for i in range( n ):
+            self._write( i )
+        self.auto_write = auto_write
+
+    def __len__( self ):
+        return self._n
+
+    def __iter__( self ):
+        for i in range( self._n ):
+            yield self[i]
+
+    def _parse( self, value ):
+        if isinstance( value, int ):
+            return ( value >> 16 & 0xFF, value >> 8 & 0xFF, value & 0xFF )
+        if len( value ) != 3:
+            raise ValueError( "Expected tuple of length 3" )
+        return tuple( int( c ) & 0xFF for c in value )
+
+    def _write( self, i ):
+        r, g, b = self._colors[i]
+        brightness = self._brightness
+        start = len( self._header ) + i * self._bpp
+        if self._dotstar_mode:
+            self._buffer[ start ] = 0xFF
+        for offset, c in zip( self._offsets, ( r, g, b ) ):
+            self._buffer[ start + self._pixel_offset + offset ] = int( c * brightness )
+
+    def __setitem__( self, index, value ):
+        if isinstance( index, slice ):
+            for i, v in zip( range( *index.indices( self._n ) ), value ):
+                self._colors[i] = self._parse( v )
+                self._write( i )
+        else:
+            if index < 0:
+                index += self._n
+            if not 0 <= index < self._n:
+                raise IndexError
+            self._colors[ index ] = self._parse( value )
+            self._write( index )
+        if self.auto_write:
+            self.show()
+
+    def __getitem__( self, index ):
+        if isinstance( index, slice ):
+            return [ self._colors[i] for i in range( *index.indices( self._n ) ) ]
+        return self._colors[ index ]
+
+    @property
+    def brightness( self ):
+        return self._brightness
+
+    @brightness.setter
+    def brightness( self, value ):
+        self._brightness = min( max( value, 0.0 ), 1.0 )
+        for i in range( self._n ):
+            self._write( i )
+        if self.auto_write:
+            self.show()
+
+    @property
+    def byteorder( self ):
+        return self._byteorder
+
+    def fill( self, color ):
+        color = self._parse( color )
+        for i in range( self._n ):
+            self._colors[i] = color
+            self._write( i )
+        if self.auto_write:
+            self.show()
+
+    def show( self ):
+        self._transmit( self._buffer )
+
+    def _transmit( self, buffer ):
+        raise NotImplementedError( "Must be subclassed" )
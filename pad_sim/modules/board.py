@@ -0,0 +1,26 @@
+# board.py - pad_sim stand-in for the CircuitPython board module (Raspberry Pi Pico)
+
+__author__ = "thekraftyman"
+
+
+class Pin:
+    '''
+    A named microcontroller pin
+    '''
+    def __init__( self, name ):
+        self.name = name
+
+    def __repr__( self ):
+        return f"board.{self.name}"
+
+
+for _i in range( 29 ):
+    globals()[ f"GP{_i}" ] = Pin( f"GP{_i}" )
+
+LED = GP25
+VOLTAGE_MONITOR = Pin( "A3" )
+A0 = GP26
+A1 = GP27
+A2 = GP28
+SMPS_MODE = GP23
+VBUS_SENSE = GP24
@@ -0,0 +1,94 @@
+# busio.py - pad_sim stand-in for the CircuitPython busio module
+
+__author__ = "thekraftyman"
+
+import pad_sim
+
+
+class I2C:
+    '''
+    A simulated i2c bus. Transactions are routed to the expanders wired in the
+      simulator and recorded with their bus time
+    '''
+    def __init__( self, scl, sda, *, frequency=100000, timeout=255 ):
+        self.frequency = frequency
+        self._locked = False
+
+    def _device( self, address ):
+        device = pad_sim.current().expanders.get( address )
+        if device is None:
+            raise OSError( 19, "No such device" )
+        return device
+
+    def try_lock( self ):
+        if self._locked:
+            return False
+        self._locked = True
+        return True
+
+    def unlock( self ):
+        self._locked = False
+
+    def scan( self ):
+        return sorted( pad_sim.current().expanders )
+
+    def writeto( self, address, buffer, *, start=0, end=None ):
+        data = buffer[ start:end ]
+        self._device( address ).write( data )
+        pad_sim.current().i2c_transfer( self.frequency, address, "w", len( data ) )
+
+    def readfrom_into( self, address, buffer, *, start=0, end=None ):
+        end = len( buffer ) if end is None else end
+        buffer[ start:end ] = self._device( address ).read( end - start )
+        pad_sim.current().i2c_transfer( self.frequency, address, "r", end - start )
+
+    def writeto_then_readfrom( self, address, out_buffer, in_buffer, *, out_start=0, out_end=None, in_start=0, in_end=None ):
+        data = out_buffer[ out_start:out_end ]
+        in_end = len( in_buffer ) if in_end is None else in_end
+        device = self._device( address )
+        device.write( data )
+        in_buffer[ in_start:in_end ] = device.read( in_end - in_start )
+        pad_sim.current().i2c_transfer( self.frequency, address, "wr", len( data ) + in_end - in_start )
+
+    def deinit( self ):
+        pass
+
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, *args ):
+        self.deinit()
+
+
+class SPI:
+    '''
+    A simulated spi bus. Writes are recorded with their bus time. Raises
+      NotImplementedError when the simulator has hardware spi turned off
+    '''
+    def __init__( self, clock, MOSI=None, MISO=None ):
+        if not pad_sim.current().hardware_spi:
+            raise NotImplementedError( "No hardware SPI on this pin" )
+        self.baudrate = 100000
+        self._locked = False
+
+    def try_lock( self ):
+        if self._locked:
+            return False
+        self._locked = True
+        return True
+
+    def unlock( self ):
+        self._locked = False
+
+    def configure( self, *, baudrate=100000, polarity=0, phase=0, bits=8 ):
+        self.baudrate = baudrate
+
+    @property
+    def frequency( self ):
+        return self.baudrate
+
+    def write( self, buffer, *, start=0, end=None ):
+        pad_sim.current().spi_write( self.baudrate, buffer[ start:end ] )
+
+    def deinit( self ):
+        pass
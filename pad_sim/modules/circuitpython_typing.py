@@ -0,0 +1,8 @@
+# circuitpython_typing.py - pad_sim stand-in for the circuitpython_typing annotations
+
+__author__ = "thekraftyman"
+
+from typing import Union
+
+ReadableBuffer = Union[ bytes, bytearray, memoryview ]
+WriteableBuffer = Union[ bytearray, memoryview ]
@@ -0,0 +1,75 @@
+# digitalio.py - pad_sim stand-in for the CircuitPython digitalio module
+
+__author__ = "thekraftyman"
+
+import pad_sim
+
+
+class Direction:
+    INPUT = "INPUT"
+    OUTPUT = "OUTPUT"
+
+
+class Pull:
+    UP = "UP"
+    DOWN = "DOWN"
+
+
+class DriveMode:
+    PUSH_PULL = "PUSH_PULL"
+    OPEN_DRAIN = "OPEN_DRAIN"
+
+
+class DigitalInOut:
+    '''
+    A simulated gpio. Writes are counted, reads of an input come from whatever the
+      simulator wires to the pin, falling back to the pull
+    '''
+    def __init__( self, pin ):
+        self.pin = pin
+        self._direction = Direction.INPUT
+        self.pull = None
+        self.drive_mode = DriveMode.PUSH_PULL
+        self._value = False
+
+    @property
+    def direction( self ):
+        return self._direction
+
+    @direction.setter
+    def direction( self, direction ):
+        self._direction = direction
+
+    @property
+    def value( self ):
+        if self._direction == Direction.INPUT:
+            level = pad_sim.current().pin_level( self.pin )
+            if level is not None:
+                return bool( level )
+            return self.pull == Pull.UP
+        return self._value
+
+    @value.setter
+    def value( self, value ):
+        if self._direction == Direction.INPUT:
+            raise AttributeError( "Cannot set value when direction is input." )
+        pad_sim.current().pin_writes += 1
+        self._value = bool( value )
+
+    def switch_to_input( self, pull=None ):
+        self._direction = Direction.INPUT
+        self.pull = pull
+
+    def switch_to_output( self, value=False, drive_mode=DriveMode.PUSH_PULL ):
+        self._direction = Direction.OUTPUT
+        self.drive_mode = drive_mode
+        self._value = bool( value )
+
+    def deinit( self ):
+        pass
+
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, *args ):
+        self.deinit()
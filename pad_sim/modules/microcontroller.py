@@ -0,0 +1,5 @@
+# microcontroller.py - pad_sim stand-in for the CircuitPython microcontroller module
+
+__author__ = "thekraftyman"
+
+from board import Pin
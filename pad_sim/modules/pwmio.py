@@ -0,0 +1,13 @@
+# pwmio.py - pad_sim stand-in for the CircuitPython pwmio module
+
+__author__ = "thekraftyman"
+
+
+class PWMOut:
+    def __init__( self, pin, *, duty_cycle=0, frequency=500, variable_frequency=False ):
+        self.pin = pin
+        self.duty_cycle = duty_cycle
+        self.frequency = frequency
+
+    def deinit( self ):
+        pass
@@ -0,0 +1,37 @@
+# supervisor.py - pad_sim stand-in for the CircuitPython supervisor module
+
+__author__ = "thekraftyman"
+
+import pad_sim
+
+
+class _Runtime:
+    @property
+    def usb_connected( self ):
+        sim = pad_sim.current()
+        if sim.usb_connected is True or sim.usb_connected is False:
+            return sim.usb_connected
+        return sim.clock.now() >= sim.usb_connected * 1000000
+
+    @property
+    def serial_connected( self ):
+        return True
+
+    @property
+    def serial_bytes_available( self ):
+        return len( pad_sim.current().console )
+
+
+runtime = _Runtime()
+
+
+def disable_autoreload():
+    pass
+
+
+def enable_autoreload():
+    pass
+
+
+def ticks_ms():
+    return pad_sim.current().clock.now() // 1000000 & ( ( 1 << 29 ) - 1 )
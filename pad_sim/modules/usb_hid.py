@@ -0,0 +1,40 @@
+# usb_hid.py - pad_sim stand-in for the CircuitPython usb_hid module
+
+__author__ = "thekraftyman"
+
+import pad_sim
+
+
+class Device:
+    '''
+    A simulated hid device, every report sent is logged by the simulator
+    '''
+    def __init__( self, usage_page, usage, report_length ):
+        self.usage_page = usage_page
+        self.usage = usage
+        self.report_length = report_length
+        self.last_received_report = None
+
+    def send_report( self, report, report_id=None ):
+        simulator = pad_sim.current()
+        if not simulator.usb_connected:
+            raise OSError( "USB busy" )
+        simulator.hid_report( self, report )
+
+    def get_last_received_report( self, report_id=None ):
+        return self.last_received_report
+
+
+Device.KEYBOARD = Device( 0x01, 0x06, 8 )
+Device.MOUSE = Device( 0x01, 0x02, 4 )
+Device.CONSUMER_CONTROL = Device( 0x0C, 0x01, 2 )
+
+devices = [ Device.KEYBOARD, Device.MOUSE, Device.CONSUMER_CONTROL ]
+
+
+def enable( devices, boot_device=0 ):
+    pass
+
+
+def disable():
+    pass
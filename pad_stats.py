@@ -0,0 +1,141 @@
+# pad_stats.py
+
+__author__ = "thekraftyman"
+
+'''
+Opt-in runtime instrumentation for pad_lib and ducky_engine. Pass a Stats object to
+Pad/MacroPad and DuckyEngine to collect counters and latency histograms; without one
+the instrumented code only does a None check.
+
+    stats = Stats()
+    pad = MacroPad( stats=stats )
+    de = DuckyEngine( stats=stats )
+    ...
+    stats.dump()     # or type `d` on the serial console while pad.dispatch() runs
+'''
+
+import sys
+import time
+
+try:
+    import supervisor
+except ImportError:
+    supervisor = None
+
+# --------------
+# CONTENTS
+# 1. Classes
+#   a. Histogram
+#   b. Stats (uses Histogram)
+# --------------
+
+# 1. Classes ---
+
+# 1a.
+class Histogram:
+    '''
+    Histogram object. Counts durations in fixed power of two microsecond buckets:
+      bucket 0 holds everything under 1us, bucket n everything from 2^(n-1) up to 2^n us,
+      and the last bucket everything longer
+    '''
+    NBUCKETS = 20
+
+    def __init__( self ):
+        self.buckets = [0] * self.NBUCKETS
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record( self, ns ):
+        '''
+        add a duration in nanoseconds
+        '''
+        self.count += 1
+        self.total += ns
+        if ns > self.max:
+            self.max = ns
+        bucket = 0
+        us = ns // 1000
+        while us and bucket < self.NBUCKETS - 1:
+            us >>= 1
+            bucket += 1
+        self.buckets[ bucket ] += 1
+
+    @property
+    def mean( self ):
+        '''
+        mean duration in nanoseconds
+        '''
+        return self.total // self.count if self.count else 0
+
+    def percentile( self, fraction ):
+        '''
+        upper bound in microseconds of the bucket holding the given fraction of samples
+        '''
+        target = self.count * fraction
+        seen = 0
+        for bucket, n in enumerate( self.buckets ):
+            seen += n
+            if n and seen >= target:
+                return 1 << bucket
+        return 0
+
+
+# 1b.
+class Stats:
+    '''
+    Stats object. A registry of named counters and histograms shared by the pad and the
+      ducky engine, dumpable over the serial console
+    '''
+    def __init__( self ):
+        self.counters = {}
+        self.histograms = {}
+        self.started = time.monotonic_ns()
+
+    def count( self, name, n=1 ):
+        '''
+        add n to a counter
+        '''
+        self.counters[ name ] = self.counters.get( name, 0 ) + n
+
+    def record( self, name, ns ):
+        '''
+        add a duration in nanoseconds to a histogram
+        '''
+        histogram = self.histograms.get( name )
+        if histogram is None:
+            histogram = self.histograms[ name ] = Histogram()
+        histogram.record( ns )
+
+    def reset( self ):
+        '''
+        clear every counter and histogram
+        '''
+        self.counters = {}
+        self.histograms = {}
+        self.started = time.monotonic_ns()
+
+    def dump( self ):
+        '''
+        print every counter, and every histogram's count, mean, p50, p99 and max in us
+        '''
+        elapsed = ( time.monotonic_ns() - self.started ) / 1000000000
+        print( f"[STATS] {elapsed:.1f}s" )
+        for name in sorted( self.counters ):
+            value = self.counters[ name ]
+            print( f"[STATS] {name}: {value} ({value / elapsed if elapsed else 0:.1f}/s)" )
+        for name in sorted( self.histograms ):
+            h = self.histograms[ name ]
+            print( f"[STATS] {name}: n={h.count} mean={h.mean // 1000}us p50<{h.percentile(0.5)}us p99<{h.percentile(0.99)}us max={h.max // 1000}us" )
+
+    def poll_console( self ):
+        '''
+        read a command from the serial console if one is waiting: `d` dumps, `r` resets
+        '''
+        if supervisor is None or not supervisor.runtime.serial_bytes_available:
+            return
+        command = sys.stdin.read( 1 )
+        if command == "d":
+            self.dump()
+        elif command == "r":
+            self.reset()
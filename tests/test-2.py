@@ -1,8 +1,7 @@
 # test-2.py
 
 import os
-from macro_pad import MacroPad
-from time import sleep
+from pad_lib import MacroPad, HOLD
 
 def main():
     # init the macro pad
@@ -10,37 +9,15 @@ def main():
 
     # bind some keys
     pad.bind_key( 0, say_hello, color=[100,0,0] )
-    pad.bind_key( 1, say_hello, color=[0,0,100] )
+    pad.bind_key( 1, say_hello, color=[0,0,100], kwargs={ 'name' : 'thekraftyman' } )
+    pad.bind_key( 2, say_hello, color=[0,100,0], kwargs={ 'name' : 'holder' }, event=HOLD )
+    # repeats 5 times a second after being held for half a second
+    pad.bind_key( 3, say_hello, color=[100,100,0], kwargs={ 'name' : 'repeater' }, repeat=( 500, 5 ) )
 
-    # add some options
-    options = {
-        1 : {
-            'kwargs' : { 'name' : 'thekraftyman' },
-            'held' : False
-        }
-    }
-
-    # run the loop
+    # run the loop, each press fires its binding once
     while True:
-        # see if any buttons are being pressed
-        if not pad.is_pressed:
-            sleep( 0.1 )
-            continue
-
-        # iterate through pressed buttons
-        for button in pad.bound_pressed_buttons:
-            if button in options and 'kwargs' in options[button]:
-                if 'held' in options[button] and options[button]['held']:
-                    pad.call( button, **options[button]['kwargs'] )
-                    while button in pad.bound_pressed_buttons:
-                        sleep(0.05)
-                else:
-                    pad.call( button, **options[button]['kwargs'] )
-            else:
-                pad.call( button )
-
-        # sleep to make sure we don't run the button too many times
-        sleep( 0.5 )
+        pad.dispatch()
+        pad.wait_for_scan()
 
 def say_hello( name=None ):
     tosay = "Hello"
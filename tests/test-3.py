@@ -2,13 +2,15 @@
 
 from ducky_engine import DuckyEngine
 from pad_lib import MacroPad
-from time import sleep
 
 def main():
     # create pad and ducky engine
     pad = MacroPad()
     de = DuckyEngine()
 
+    # keep scanning while a script runs, so presses made meanwhile aren't lost
+    de.idle = pad.poll
+
     # define keys
     ## Key 0
     ks_0 = """
@@ -30,28 +32,13 @@ def main():
     kc_1 = [255, 0, 0]
 
     # bind the keys with the scripts & colors
-    pad.bind_key( 0, de.run_multiline_string, color=kc_0 )
-    pad.bind_key( 1, de.run_multiline_string, color=kc_1 )
-
-    # add options
-    options = {
-        0 : {
-            'kwargs' : { 'in_str' : ks_0 },
-        },
-        1 : {
-            'kwargs' : { 'in_str' : ks_1 },
-        }
-    }
+    pad.bind_key( 0, de.compile( ks_0 ), color=kc_0 )
+    pad.bind_key( 1, de.compile( ks_1 ), color=kc_1 )
 
     # run the loop
     while True:
-        if not pad.is_pressed:
-            sleep( 0.1 )
-            continue
-        for button in pad.bound_pressed_buttons:
-            pad.call( button, **options[button]['kwargs'] )
-        sleep(0.5)
+        pad.dispatch()
+        pad.wait_for_scan()
 
 if __name__ == "__main__":
     main()
-
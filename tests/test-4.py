@@ -0,0 +1,33 @@
+# test-4.py
+
+import asyncio
+from ducky_engine import AsyncDuckyEngine
+from pad_lib import MacroPad
+
+def main():
+    # create pad and async ducky engine
+    pad = MacroPad()
+    de = AsyncDuckyEngine()
+
+    # a long macro, the pad keeps scanning during its delays
+    ks_0 = """
+    GUI R
+    DELAY 500
+    STRING notepad
+    ENTER
+    DELAY 1000
+    STRING written while the pad kept scanning
+    """
+    ks_1 = """
+    STRING (PDF)
+    """
+
+    # bind the keys with the compiled scripts & colors
+    pad.bind_key( 0, de.compile( ks_0 ), color=[0, 0, 255] )
+    pad.bind_key( 1, de.compile( ks_1 ), color=[0, 255, 0] )
+
+    # run the pad, up to 2 macros at once
+    asyncio.run( pad.run( scan_rate=200, max_macros=2 ) )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+# test-5.py
+# runs on a computer: drives the pad and ducky engine through the host simulator
+
+import asyncio
+import os
+import sys
+import tempfile
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) ) )
+
+import pad_sim
+sim = pad_sim.install()
+
+from time import monotonic_ns, sleep
+from ducky_engine import AsyncDuckyEngine, DuckyEngine
+from pad_lib import MacroPad
+from pad_stats import Stats
+
+def main():
+    # create pad and ducky engine
+    pad = MacroPad()
+    de = DuckyEngine()
+    pad.bind_key( 0, de.compile( "STRING hi" ), color=[0, 255, 0] )
+    pad.bind_key( 1, de.compile( "GUI L" ), color=[255, 0, 0] )
+
+    # script the presses, key 0 with some contact bounce
+    sim.reset_logs()
+    sim.keypad.script( [ (10, 0, True), (11, 0, False), (12, 0, True), (80, 0, False) ] )
+    sim.keypad.tap( 1, at=200, duration=30 )
+
+    # run the loop for half a second of virtual time
+    for i in range( 100 ):
+        pad.dispatch()
+        sleep( 0.005 )
+
+    # check what the host received
+    typed = [ report.hex() for at, report in sim.keyboard_reports ]
+    assert typed == [
+        "00000b0000000000", "00000c0000000000", "0000000000000000",   # h, i, release
+        "0800000000000000", "08000f0000000000", "0000000000000000",   # GUI, GUI+L, release
+    ], typed
+    summary = f"ok: {len( sim.i2c_log )} i2c transactions, {len( sim.spi_log )} spi writes, {len( typed )} hid reports"
+
+    # a script file is compiled on its first press, and again once it's edited
+    path = os.path.join( tempfile.mkdtemp(), "payload.txt" )
+    with open( path, "w" ) as outfile:
+        outfile.write( "STRING a\n" )
+    pad.bind_key( 2, de.script_file( path ) )
+    for text in ( "STRING a\n", "STRING bb\n" ):
+        with open( path, "w" ) as outfile:
+            outfile.write( text )
+        sim.reset_logs()
+        sim.keypad.tap( 2, at=10, duration=30 )
+        for i in range( 20 ):
+            pad.dispatch()
+            sleep( 0.005 )
+        typed = [ report.hex() for at, report in sim.keyboard_reports ]
+        expected = [ "0000040000000000" ] if text == "STRING a\n" else [ "0000050000000000", "0000000000000000", "0000050000000000" ]
+        assert typed == expected + [ "0000000000000000" ], typed
+    assert de.cached_scripts == [ path ], de.cached_scripts
+
+    # a script bigger than the whole cache runs without pushing the others out
+    huge = os.path.join( os.path.dirname( path ), "huge.txt" )
+    with open( huge, "w" ) as outfile:
+        outfile.write( "STRING x\n" * 1000 )
+    de.load( huge )
+    assert de.cached_scripts == [ path ] and de._file_cache_bytes <= de.cache_bytes, de.cached_scripts
+
+    # run_file streams the file, and the second run reads the precompiled ops
+    runs = []
+    for i in range( 2 ):
+        sim.reset_logs()
+        de.run_file( path )
+        runs.append( [ report.hex() for at, report in sim.keyboard_reports ] )
+    assert os.path.exists( path + ".dkc" )
+    assert runs[0] == runs[1] == expected + [ "0000000000000000" ], runs
+
+    # a press made while a long macro runs is caught by the idle hook and run after it
+    de.idle = pad.poll
+    pad.drop_key( 0 )
+    pad.bind_key( 0, de.compile( "STRING a\nDELAY 500\nSTRING b" ) )
+    sim.reset_logs()
+    sim.keypad.tap( 0, at=10, duration=30 )
+    sim.keypad.tap( 1, at=200, duration=30 )
+    for i in range( 150 ):
+        pad.dispatch()
+        sleep( 0.005 )
+    typed = [ report.hex() for at, report in sim.keyboard_reports ]
+    assert typed == [
+        "0000040000000000", "0000000000000000",                       # a
+        "0000050000000000", "0000000000000000",                       # b, after the delay
+        "0800000000000000", "08000f0000000000", "0000000000000000",   # GUI L, pressed during it
+    ], typed
+
+    # loops, variables and conditionals run from the compiled jumps
+    de.idle = None
+    sim.reset_logs()
+    de.run_compiled( de.compile( "VAR $i = 0\nWHILE $i < 3\n$i = $i + 1\nIF $i == 2 THEN\nSTRING b\nELSE\nSTRING a\nEND_IF\nEND_WHILE\nFOR 2\nSTRING c\nEND_FOR" ) )
+    typed = [ report.hex() for at, report in sim.keyboard_reports if report[2] ]
+    assert typed == [ "0000040000000000", "0000050000000000", "0000040000000000", "0000060000000000", "0000060000000000" ], typed
+
+    # a variable declared in a branch that isn't taken still reads as 0
+    sim.reset_logs()
+    de.run_compiled( de.compile( "IF FALSE THEN\nVAR $x = 1\nEND_IF\nIF $x == 0 THEN\nSTRING z\nEND_IF" ) )
+    typed = [ report.hex() for at, report in sim.keyboard_reports if report[2] ]
+    assert typed == [ "00001d0000000000" ], typed
+
+    # a value too big for a precompiled record runs without writing the record file
+    big = os.path.join( os.path.dirname( path ), "big.txt" )
+    with open( big, "w" ) as outfile:
+        outfile.write( "VAR $x = 3000000000\nIF $x > 2 THEN\nSTRING z\nEND_IF\n" )
+    sim.reset_logs()
+    de.run_file( big )
+    typed = [ report.hex() for at, report in sim.keyboard_reports if report[2] ]
+    assert typed == [ "00001d0000000000" ] and not os.path.exists( big + ".dkc" ), typed
+
+    # an async script cancelled part way through a STRING doesn't leave a key held
+    async def cancel_typing():
+        task = asyncio.create_task( ade.run_compiled( ade.compile( "STRING " + "hello world " * 20 ) ) )
+        for i in range( 3 ):
+            await asyncio.sleep( 0 )
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    ade = AsyncDuckyEngine()
+    sim.reset_logs()
+    asyncio.run( cancel_typing() )
+    typed = [ report.hex() for at, report in sim.keyboard_reports ]
+    assert 1 < len( typed ) < 200 and typed[-1] == "0000000000000000", typed
+
+    # an async STRING sent in slices reports its speed over the whole string
+    sim.reset_logs()
+    asyncio.run( ade.run_compiled( ade.compile( "STRING " + "hello world " * 20 ) ) )
+    assert ade.typing_stats == ( 239, len( sim.keyboard_reports ) * 1000000 ), ade.typing_stats
+
+    # delays follow the run's timeline, so typing between them doesn't add up
+    started = monotonic_ns()
+    de.run_compiled( de.compile( "STRING abc\nDELAY 20\n" * 5 ) )
+    assert monotonic_ns() - started == 100000000, monotonic_ns() - started
+    assert de.drift_stats == ( 5, 0, 0, 0 ), de.drift_stats
+
+    # the spi byte counter counts what a partial update really sent
+    stats = Stats()
+    counted = MacroPad( stats=stats )
+    stats.reset()
+    sim.reset_logs()
+    counted.set_color( 0, 255, 0, 0 )
+    counted.show()
+    assert stats.counters[ "spi.bytes" ] == sim.spi_bytes == 9, ( stats.counters, sim.spi_bytes )
+
+    # a second expander on the bus adds keys 16-31, read in the same scan
+    sim.add_expander( 0x21 )
+    wide = MacroPad( expanders=( 0x20, 0x21 ) )
+    hits = []
+    wide.bind_key( 17, lambda: hits.append( 17 ) )
+    sim.reset_logs()
+    sim.expanders[ 0x21 ].tap( 1, at=10, duration=30 )
+    for i in range( 20 ):
+        wide.dispatch()
+        sleep( 0.005 )
+    assert hits == [ 17 ], hits
+    assert len( sim.i2c_log ) == 2 * 20, len( sim.i2c_log )
+
+    # a pad with fewer keys than the expander has inputs leaves the rest unused
+    assert len( MacroPad( nkeys=12 ).keys ) == 12
+
+    # keys pressed together fire their chord, and a chord key on its own fires its
+    # own binding once the chord window has passed, while it's still held
+    chorded = MacroPad()
+    hits = []
+    chorded.bind_chord( ( 3, 4 ), lambda: hits.append( "3+4" ) )
+    chorded.bind_key( 3, lambda: hits.append( ( 3, monotonic_ns() - started ) ) )
+    sim.reset_logs()
+    started = monotonic_ns()
+    sim.keypad.tap( 3, at=10, duration=100 )
+    sim.keypad.tap( 4, at=20, duration=90 )
+    sim.keypad.tap( 3, at=300, duration=200 )
+    for i in range( 120 ):
+        chorded.dispatch()
+        sleep( 0.005 )
+    assert hits[0] == "3+4" and len( hits ) == 2, hits
+    assert 300000000 + 50000000 <= hits[1][1] < 300000000 + 200000000, hits
+
+    # a momentary layer key switches back on release, a toggle key on its next press
+    layered = MacroPad()
+    layered.add_layer( "fn" )
+    layered.bind_layer( 5, "fn", momentary=True )
+    layered.bind_layer( 6, "fn" )
+    layered.bind_key( 7, lambda: hits.append( layered.layer.name ) )
+    layered.bind_key( 7, lambda: hits.append( layered.layer.name ), layer="fn" )
+    held = [ ( 5, 10, 100 ) ]                  # key 7 is tapped while 5 is held
+    toggled = [ ( 6, 10, 20 ), ( 6, 110, 20 ) ]  # and between the two presses of 6
+    for layer_taps in ( held, toggled ):
+        hits = []
+        sim.reset_logs()
+        for key_num, at, duration in layer_taps + [ ( 7, 60, 20 ), ( 7, 160, 20 ) ]:
+            sim.keypad.tap( key_num, at=at, duration=duration )
+        for i in range( 50 ):
+            layered.dispatch()
+            sleep( 0.005 )
+        assert hits == [ "fn", "base" ] and layered.layer.name == "base", ( layer_taps, hits )
+
+    # a held key repeats after its delay at its rate, and stops once it's released
+    repeating = MacroPad()
+    hits = []
+    repeating.bind_key( 8, lambda: hits.append( monotonic_ns() - started ), repeat=( 100, 20 ) )
+    sim.reset_logs()
+    started = monotonic_ns()
+    sim.keypad.tap( 8, at=10, duration=300 )
+    for i in range( 130 ):
+        repeating.dispatch()
+        sleep( 0.005 )
+    # the press, then repeats near 110, 160, 210 and 260 ms, and none after 310 ms
+    assert len( hits ) == 5 and hits[-1] < 310000000, hits
+
+    # a held key stops repeating when its binding is dropped or the layer switches
+    repeating.add_layer( "fn" )
+    for stop in ( lambda: repeating.drop_key( 8 ), lambda: repeating.switch_layer( "fn" ) ):
+        repeating.switch_layer( "base" )
+        if not repeating.is_bound( 8 ):
+            repeating.bind_key( 8, lambda: hits.append( 8 ), repeat=( 100, 20 ) )
+        hits = []
+        sim.reset_logs()
+        sim.keypad.tap( 8, at=10, duration=300 )
+        for i in range( 30 ):
+            repeating.dispatch()
+            sleep( 0.005 )
+        stop()
+        for i in range( 70 ):
+            repeating.dispatch()
+            sleep( 0.005 )
+        assert len( hits ) == 2, hits   # the press and the repeat at 110 ms
+
+    # a binding config is compiled on the first boot and loaded compiled on the next
+    config = os.path.join( os.path.dirname( path ), "config.json" )
+    with open( config, "w" ) as outfile:
+        outfile.write( '{ "keys": { "0": { "script": "STRING a", "color": [ 0, 0, 255 ] } } }' )
+    runs = []
+    for i in range( 2 ):
+        pad = MacroPad()
+        pad.load_config( config, de )
+        assert os.path.exists( config + ".pdc" )
+        sim.reset_logs()
+        sim.keypad.tap( 0, at=10, duration=30 )
+        for i in range( 20 ):
+            pad.dispatch()
+            sleep( 0.005 )
+        runs.append( [ report.hex() for at, report in sim.keyboard_reports ] )
+    assert runs[0] == runs[1] == [ "0000040000000000", "0000000000000000" ], runs
+
+    # a config that fails part way through binding is neither compiled nor half bound
+    broken = os.path.join( os.path.dirname( path ), "broken.json" )
+    with open( broken, "w" ) as outfile:
+        outfile.write( '{ "layers": { "base": { "keys": { "0": { "script": "STRING a" }, "1": { "call": "volume" } } }, "fn": { "keys": {} } } }' )
+    pad = MacroPad()
+    error = None
+    try:
+        pad.load_config( broken, de )
+    except Exception as caught:
+        error = caught
+    assert error is not None and "volume" in str( error ), error
+    assert not os.path.exists( broken + ".pdc" )
+    assert not pad.is_bound( 0 ) and list( pad.layers ) == [ "base" ], pad.layers
+    pad.load_config( broken, de, actions={ "volume": lambda: None } )
+    assert os.path.exists( broken + ".pdc" ) and pad.is_bound( 1 )
+
+    # two macros running at once on one async engine each keep their own timeline
+    # and default delay, on the host clock since asyncio sleeps for real
+    first, second = "DELAY 100\nDELAY 100\nDELAY 100", "DEFAULT_DELAY 5\nDELAY 30\nDELAY 200"
+    took = {}
+    async def timed( script, after ):
+        await asyncio.sleep( after )
+        began = monotonic_ns()
+        await ade.run_compiled( ade.compile( script ) )
+        took[ script ] = ( monotonic_ns() - began ) // 1000000
+    async def overlapping():
+        await asyncio.gather( timed( first, 0 ), timed( second, 0.05 ) )
+    pad_sim.install( virtual_time=False )
+    ade = AsyncDuckyEngine()
+    asyncio.run( overlapping() )
+    assert 300 <= took[ first ] < 350 and 380 <= took[ second ] < 430, took
+    assert ade.drift_stats[0] == 5 and ade.default_delay == 0, ( ade.drift_stats, ade.default_delay )
+
+    print( summary )
+
+if __name__ == "__main__":
+    main()